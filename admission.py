@@ -0,0 +1,157 @@
+# admission.py - per-client rate limits and load shedding for the Flask routes
+import math
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import config
+
+ADMISSION_ENABLED = getattr(config, "ADMISSION_ENABLED", True)
+
+# Per route class: token bucket per client (rate/s, burst), worker slots,
+# the queueing latency we accept before shedding; service_time is the initial
+# estimate of how long one request takes.
+CLASS_LIMITS = {
+    "cheap": {"rate": 10.0, "burst": 30, "slots": 8, "latency_target": 2.0, "service_time": 0.1},
+    "expensive": {"rate": 0.2, "burst": 5, "slots": 2, "latency_target": 30.0, "service_time": 5.0},
+    # Long-lived /jobs/<id>/events streams: a few at a time, never queued.
+    "stream": {"rate": 0.5, "burst": 3, "slots": 2, "latency_target": 0.0, "service_time": 60.0},
+}
+CLASS_LIMITS.update(getattr(config, "ADMISSION_LIMITS", {}))
+
+# Threads per gunicorn worker (see gunicorn.conf.py). Non-cheap requests,
+# running or waiting, may hold at most THREADS - CHEAP_RESERVE of them, so
+# cheap routes always find a thread instead of queueing in gunicorn's backlog
+# where admission control never sees them.
+THREADS = int(os.environ.get("GUNICORN_THREADS", 12))
+CHEAP_RESERVE = int(getattr(config, "ADMISSION_CHEAP_RESERVE", 4))
+
+MAX_BUCKETS = 10000
+
+
+class AdmissionError(Exception):
+    def __init__(self, status: int, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Take a token; returns 0 on success, else seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionController:
+    """
+    Admits a request only if the client has a token for its route class and
+    a worker slot frees up within the class latency target. Cheap routes have
+    their own slots and go first: expensive requests wait while cheap ones are
+    queued, and non-cheap requests never hold more than threads - cheap_reserve
+    of the worker's threads. Everything is per process.
+    """
+
+    def __init__(self, limits: Dict[str, Dict] = CLASS_LIMITS, enabled: bool = ADMISSION_ENABLED,
+                 threads: int = THREADS, cheap_reserve: int = CHEAP_RESERVE):
+        self.limits = limits
+        self.enabled = enabled
+        self.threads = threads
+        self.cheap_reserve = cheap_reserve
+        self._cond = threading.Condition()
+        self._buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self._in_flight = {c: 0 for c in limits}
+        self._waiting = {c: 0 for c in limits}
+        # EWMA of service time per class, used to predict queueing delay.
+        self._service_time = {c: float(limits[c].get("service_time", 1.0)) for c in limits}
+        self._stats = {c: {"admitted": 0, "rate_limited": 0, "shed_queue": 0, "shed_timeout": 0,
+                           "shed_threads": 0} for c in limits}
+
+    def _check_rate(self, cls: str, client: str):
+        limits = self.limits[cls]
+        key = (cls, client)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= MAX_BUCKETS:
+                # Drop buckets that have refilled completely; they carry no state.
+                now = time.monotonic()
+                for k, b in list(self._buckets.items()):
+                    if b.tokens + (now - b.updated) * b.rate >= b.burst:
+                        del self._buckets[k]
+            bucket = self._buckets[key] = TokenBucket(limits["rate"], limits["burst"])
+        wait = bucket.take()
+        if wait:
+            self._stats[cls]["rate_limited"] += 1
+            raise AdmissionError(429, "Too many requests", wait)
+
+    def _blocked(self, cls: str) -> bool:
+        if self._in_flight[cls] >= self.limits[cls]["slots"]:
+            return True
+        return cls != "cheap" and self._waiting.get("cheap", 0) > 0
+
+    def acquire(self, cls: str, client: str) -> Optional[float]:
+        """Reserve a slot; returns the start time for release(), or raises AdmissionError."""
+        if not self.enabled or cls not in self.limits:
+            return None
+        limits = self.limits[cls]
+        with self._cond:
+            self._check_rate(cls, client)
+            if cls != "cheap":
+                held = sum(self._in_flight[c] + self._waiting[c] for c in self.limits if c != "cheap")
+                if held >= self.threads - self.cheap_reserve:
+                    self._stats[cls]["shed_threads"] += 1
+                    raise AdmissionError(503, "Server busy", self._service_time[cls] / limits["slots"])
+            if self._blocked(cls):
+                expected = (self._waiting[cls] + 1) * self._service_time[cls] / limits["slots"]
+                if expected > limits["latency_target"]:
+                    self._stats[cls]["shed_queue"] += 1
+                    raise AdmissionError(503, "Server busy", expected)
+                deadline = time.monotonic() + limits["latency_target"]
+                self._waiting[cls] += 1
+                try:
+                    while self._blocked(cls):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._stats[cls]["shed_timeout"] += 1
+                            raise AdmissionError(503, "Server busy", self._service_time[cls])
+                        self._cond.wait(remaining)
+                finally:
+                    self._waiting[cls] -= 1
+                    self._cond.notify_all()
+            self._in_flight[cls] += 1
+            self._stats[cls]["admitted"] += 1
+        return time.monotonic()
+
+    def release(self, cls: str, started: Optional[float]):
+        if started is None:
+            return
+        elapsed = time.monotonic() - started
+        with self._cond:
+            self._in_flight[cls] -= 1
+            self._service_time[cls] = 0.8 * self._service_time[cls] + 0.2 * elapsed
+            self._cond.notify_all()
+
+    def stats(self) -> Dict:
+        with self._cond:
+            classes = {c: dict(self._stats[c], in_flight=self._in_flight[c], waiting=self._waiting[c],
+                               service_time=round(self._service_time[c], 3), slots=self.limits[c]["slots"])
+                       for c in self.limits}
+        return {"classes": classes, "threads": self.threads, "cheap_reserve": self.cheap_reserve}
+
+
+controller = AdmissionController()
@@ -2,36 +2,108 @@
 import os
 import logging
 import base64
-import requests
-from functools import lru_cache
+import threading
+import time
 from typing import List, Dict, Optional
+from urllib.parse import quote
 import config
+from records import MediaRecord, RecordCache
 
 logger = logging.getLogger(__name__)
-if not logger.handlers:
-    handler = logging.StreamHandler()
-    formatter = logging.Formatter("%(asctime)s %(levelname)s %(message)s")
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
-logger.setLevel(logging.INFO)
 
 TMDB_API_KEY = os.environ.get("TMDB_API_KEY") or getattr(config, "TMDB_API_KEY", None)
 OPENROUTER_API_KEY = os.environ.get("OPENROUTER_API_KEY") or getattr(config, "OPENROUTER_API_KEY", None)
 
-if OPENROUTER_API_KEY:
-    logger.info("OpenRouter API Key is configured and ready.")
-else:
-    logger.error("CRITICAL ERROR: OPENROUTER_API_KEY is missing in environment variables.")
-
 BASE_URL = getattr(config, "BASE_URL", "https://api.themoviedb.org/3")
 IMAGE_URL = getattr(config, "IMAGE_URL", "https://image.tmdb.org/t/p/w500")
 REQUEST_TIMEOUT = getattr(config, "REQUEST_TIMEOUT", 10)
 
+# Structured mode asks the model for compact JSON (parsed by titles.parse_reply)
+# instead of prose with [Bracketed] titles.
+STRUCTURED_OUTPUT = getattr(config, "STRUCTURED_OUTPUT", False)
+STRUCTURED_MAX_TOKENS = getattr(config, "STRUCTURED_MAX_TOKENS", 400)
+JSON_REPLY_RULE = (
+    'Reply ONLY with a JSON object: {"commentary": "<short answer>", '
+    '"titles": [{"title": "<English title>", "year": <release year>, "type": "movie" or "tv"}]}.'
+)
+
+TRAILER_TTL = getattr(config, "TRAILER_TTL", 24 * 3600)
+# Per-worker result caches, bounded by memory rather than entry count.
+CONTENT_CACHE_BYTES = getattr(config, "CONTENT_CACHE_BYTES", 2 * 1024 * 1024)
+SEARCH_CACHE_BYTES = getattr(config, "SEARCH_CACHE_BYTES", 2 * 1024 * 1024)
+TRAILER_CACHE_SIZE = 2048
+
+# Created on first use so importing this module stays cheap on cold start.
+_session = None
+_session_lock = threading.Lock()
+
+# Set when TMDB answers 429; background work (prefetch) backs off until then.
+tmdb_throttled_until = 0.0
+_trailer_cache: Dict[tuple, tuple] = {}  # (content_type, item_id) -> (expires_at, key)
+_trailer_lock = threading.Lock()
+content_cache = RecordCache(CONTENT_CACHE_BYTES)
+search_cache = RecordCache(SEARCH_CACHE_BYTES)
+
+
+def _setup_logging():
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        formatter = logging.Formatter("%(asctime)s %(levelname)s %(message)s")
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+
+    if OPENROUTER_API_KEY:
+        logger.info("OpenRouter API Key is configured and ready.")
+    else:
+        logger.error("CRITICAL ERROR: OPENROUTER_API_KEY is missing in environment variables.")
+
+
+# Only adds a handler and checks the key; cheap enough to run at import.
+_setup_logging()
+
+
+def _http():
+    """
+    Shared requests.Session (connection pooling), created on first use.
+    `requests` itself is imported here rather than at module import.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                import requests
+                _session = requests.Session()
+    return _session
+
+
+def _tmdb_get(url: str, timeout: float = REQUEST_TIMEOUT):
+    global tmdb_throttled_until
+    resp = _http().get(url, timeout=timeout)
+    if resp.status_code == 429:
+        try:
+            retry_after = float(resp.headers.get("Retry-After", 10))
+        except ValueError:
+            retry_after = 10.0
+        tmdb_throttled_until = time.time() + retry_after
+        logger.warning("TMDB rate limited; backing off for %ss", retry_after)
+    return resp
+
+
+def tmdb_throttled() -> bool:
+    return time.time() < tmdb_throttled_until
+
 
-def _call_openrouter(messages: List[Dict], temperature: float = 0.7) -> str:
+def is_error_reply(text: str) -> bool:
+    """The AI helpers report failures as text starting with "Error"."""
+    return (text or "").startswith("Error")
+
+
+def _call_openrouter(messages: List[Dict], temperature: float = 0.7, structured: bool = False) -> str:
     """
     Unified call to OpenRouter (or compatible) chat completions.
     Returns text or an error string.
+    structured: request a JSON object reply with a smaller token budget.
     """
     if not OPENROUTER_API_KEY:
         return "Error: OPENROUTER_API_KEY is missing. Please add it to environment."
@@ -47,11 +119,13 @@ def _call_openrouter(messages: List[Dict], temperature: float = 0.7) -> str:
         "model": "google/gemini-flash-1.5",
         "messages": messages,
         "temperature": temperature,
-        "max_tokens": 800,
+        "max_tokens": STRUCTURED_MAX_TOKENS if structured else 800,
     }
+    if structured:
+        payload["response_format"] = {"type": "json_object"}
 
     try:
-        resp = requests.post(url, json=payload, headers=headers, timeout=25)
+        resp = _http().post(url, json=payload, headers=headers, timeout=25)
     except Exception as e:
         logger.exception("Connection Exception to OpenRouter")
         return "Error: Failed to connect to AI server."
@@ -83,6 +157,14 @@ def _call_openrouter(messages: List[Dict], temperature: float = 0.7) -> str:
         return "Error: Invalid response from AI provider."
 
 
+TMDB_LANGUAGES = {"ar": "ar-SA", "en": "en-US", "de": "de-DE"}
+
+
+def tmdb_language(lang: str) -> str:
+    """Map a UI language code (ar/en/de) to a TMDB locale."""
+    return TMDB_LANGUAGES.get(lang, "ar-SA")
+
+
 def get_lang_instruction(lang: str) -> str:
     if lang == "en":
         return "Speak ONLY in English."
@@ -91,11 +173,17 @@ def get_lang_instruction(lang: str) -> str:
     return "Speak ONLY in Arabic."
 
 
-def chat_with_ai_formatted(messages: List[Dict], persona: str, lang: str = "ar") -> str:
+def get_titles_rule(structured: bool) -> str:
+    return JSON_REPLY_RULE if structured else "Titles in [Brackets]."
+
+
+def chat_with_ai_formatted(messages: List[Dict], persona: str, lang: str = "ar",
+                           structured: bool = STRUCTURED_OUTPUT) -> str:
     """
     Prepare system prompt and forward to OpenRouter.
     messages: list of dicts with 'role' and 'content'
     persona: string to tweak system prompt
+    structured: ask for a JSON reply instead of [Bracketed] titles
     """
     lang_rule = get_lang_instruction(lang)
     sys_msg = "You are CimaBot, a helpful movie expert."
@@ -107,16 +195,19 @@ def chat_with_ai_formatted(messages: List[Dict], persona: str, lang: str = "ar")
     elif "fan" in p:
         sys_msg = "You are a hyped fanboy! Use emojis!"
 
-    system_prompt = (
-        f"{sys_msg} RULES: 1. {lang_rule} 2. Movie titles MUST be in English inside [Brackets]. 3. Be concise."
-    )
+    if structured:
+        system_prompt = f"{sys_msg} RULES: 1. {lang_rule} 2. {JSON_REPLY_RULE} 3. Be concise."
+    else:
+        system_prompt = (
+            f"{sys_msg} RULES: 1. {lang_rule} 2. Movie titles MUST be in English inside [Brackets]. 3. Be concise."
+        )
     formatted_msgs = [{"role": "system", "content": system_prompt}]
     for m in messages:
         formatted_msgs.append({"role": m.get("role", "user"), "content": str(m.get("content", ""))})
-    return _call_openrouter(formatted_msgs)
+    return _call_openrouter(formatted_msgs, structured=structured)
 
 
-def analyze_image_search(image_file, lang: str = "ar") -> str:
+def analyze_image_search(image_file, lang: str = "ar", structured: bool = STRUCTURED_OUTPUT) -> str:
     """
     Send multimodal request to OpenRouter: text + base64 image.
     """
@@ -126,50 +217,62 @@ def analyze_image_search(image_file, lang: str = "ar") -> str:
     try:
         image_file.seek(0)
         img_data = base64.b64encode(image_file.read()).decode("utf-8")
-        prompt = f"Analyze the mood of this image and recommend 3 movies. {get_lang_instruction(lang)} Titles in [Brackets]."
+        prompt = f"Analyze the mood of this image and recommend 3 movies. {get_lang_instruction(lang)} {get_titles_rule(structured)}"
         messages = [
             {
                 "role": "user",
                 "content": [
                     {"type": "text", "text": prompt},
-                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{img_data}"}}},
+                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{img_data}"}},
                 ],
             }
         ]
-        return _call_openrouter(messages)
+        return _call_openrouter(messages, structured=structured)
     except Exception:
         logger.exception("Image Processing Error")
         return "Error analyzing image."
 
 
-def analyze_dna(movies: List[str], lang: str = "ar") -> str:
+def analyze_dna(movies: List[str], lang: str = "ar", structured: bool = STRUCTURED_OUTPUT) -> str:
     valid = [m for m in movies if m]
     if not valid:
         return "Please enter movies."
-    prompt = f"User likes: {', '.join(valid)}. Analyze personality and suggest 3 NEW movies. {get_lang_instruction(lang)} Titles in [Brackets]."
-    return _call_openrouter([{"role": "user", "content": prompt}])
+    prompt = f"User likes: {', '.join(valid)}. Analyze personality and suggest 3 NEW movies. {get_lang_instruction(lang)} {get_titles_rule(structured)}"
+    return _call_openrouter([{"role": "user", "content": prompt}], structured=structured)
+
+
+def find_match(u1: str, u2: str, lang: str = "ar", structured: bool = STRUCTURED_OUTPUT) -> str:
+    prompt = f"Matchmaker: Person A likes {u1}. Person B likes {u2}. Find middle ground movies. {get_lang_instruction(lang)} {get_titles_rule(structured)}"
+    return _call_openrouter([{"role": "user", "content": prompt}], structured=structured)
 
 
-def find_match(u1: str, u2: str, lang: str = "ar") -> str:
-    prompt = f"Matchmaker: Person A likes {u1}. Person B likes {u2}. Find middle ground movies. {get_lang_instruction(lang)} Titles in [Brackets]."
-    return _call_openrouter([{"role": "user", "content": prompt}])
+def _to_records(results: List[Dict], content_type: Optional[str] = None) -> List[MediaRecord]:
+    """Project raw TMDB results to MediaRecords (dropping people from search/multi)."""
+    return [MediaRecord.from_tmdb(item, content_type) for item in results
+            if item.get("id") and item.get("media_type", "movie") in ("movie", "tv")]
 
 
-@lru_cache(maxsize=128)
-def fetch_content(content_type: str = "movie", category: str = "popular", region: Optional[str] = None):
+def fetch_content(content_type: str = "movie", category: str = "popular", region: Optional[str] = None,
+                  language: str = "ar-SA") -> List[MediaRecord]:
     if not TMDB_API_KEY:
         return []
+    cache_key = (content_type, category, region, language)
+    cached = content_cache.get(cache_key)
+    if cached is not None:
+        return cached
     endpoint = "movie" if content_type == "movie" else "tv"
     try:
         if region:
             r_map = {"korea": "ko", "india": "hi", "arabic": "ar", "turkey": "tr", "spain": "es", "japan": "ja"}
             lang = r_map.get(region, "en")
-            url = f"{BASE_URL}/discover/{endpoint}?api_key={TMDB_API_KEY}&language=ar-SA&sort_by=popularity.desc&with_original_language={lang}"
+            url = f"{BASE_URL}/discover/{endpoint}?api_key={TMDB_API_KEY}&language={language}&sort_by=popularity.desc&with_original_language={lang}"
         else:
-            url = f"{BASE_URL}/{endpoint}/{category}?api_key={TMDB_API_KEY}&language=ar-SA"
-        resp = requests.get(url, timeout=REQUEST_TIMEOUT)
+            url = f"{BASE_URL}/{endpoint}/{category}?api_key={TMDB_API_KEY}&language={language}"
+        resp = _tmdb_get(url)
         if resp.status_code == 200:
-            return resp.json().get("results", [])
+            records = _to_records(resp.json().get("results", []), endpoint)
+            content_cache.put(cache_key, records)
+            return records
         logger.warning("TMDB fetch_content returned status %s", resp.status_code)
         return []
     except Exception:
@@ -177,16 +280,31 @@ def fetch_content(content_type: str = "movie", category: str = "popular", region
         return []
 
 
-def search_tmdb(query: str, content_type: Optional[str] = None):
+def search_tmdb(query: str, content_type: Optional[str] = None, language: str = "ar-SA",
+                year: Optional[int] = None) -> List[MediaRecord]:
     if not TMDB_API_KEY or not query:
         return []
+    typed = content_type in ["movie", "tv"]
+    cache_key = (query, content_type if typed else None, language, year)
+    cached = search_cache.get(cache_key)
+    if cached is not None:
+        return cached
     try:
-        q = requests.utils.quote(query)
-        endpoint = f"search/{content_type}" if content_type in ["movie", "tv"] else "search/multi"
-        url = f"{BASE_URL}/{endpoint}?api_key={TMDB_API_KEY}&query={q}&language=ar-SA"
-        resp = requests.get(url, timeout=REQUEST_TIMEOUT)
+        q = quote(query)
+        endpoint = f"search/{content_type}" if typed else "search/multi"
+        url = f"{BASE_URL}/{endpoint}?api_key={TMDB_API_KEY}&query={q}&language={language}"
+        if year and content_type == "movie":
+            url += f"&year={year}"
+        elif year and content_type == "tv":
+            url += f"&first_air_date_year={year}"
+        resp = _tmdb_get(url)
         if resp.status_code == 200:
-            return resp.json().get("results", [])
+            records = _to_records(resp.json().get("results", []), content_type if typed else None)
+            if year and not typed:
+                # search/multi has no year filter; move matching releases to the front
+                records.sort(key=lambda r: r.year != year)
+            search_cache.put(cache_key, records)
+            return records
         logger.warning("TMDB search returned status %s", resp.status_code)
         return []
     except Exception:
@@ -197,28 +315,48 @@ def search_tmdb(query: str, content_type: Optional[str] = None):
 def get_trailer(item_id: int, content_type: str = "movie") -> Optional[str]:
     if not TMDB_API_KEY:
         return None
+    cache_key = (content_type, str(item_id))
+    cached = _trailer_cache.get(cache_key)
+    if cached and cached[0] > time.time():
+        return cached[1]
     try:
         url = f"{BASE_URL}/{content_type}/{item_id}/videos?api_key={TMDB_API_KEY}"
-        res = requests.get(url, timeout=5)
+        res = _tmdb_get(url, timeout=5)
         if res.status_code != 200:
             return None
+        trailer = None
         for v in res.json().get("results", []):
             if v.get("type") == "Trailer" and v.get("site") == "YouTube":
-                return v.get("key")
+                trailer = v.get("key")
+                break
+        with _trailer_lock:
+            if len(_trailer_cache) >= TRAILER_CACHE_SIZE:
+                _trailer_cache.pop(next(iter(_trailer_cache)), None)
+            _trailer_cache[cache_key] = (time.time() + TRAILER_TTL, trailer)
+        return trailer
     except Exception:
         logger.exception("get_trailer error")
     return None
 
 
-def get_watch_providers(item_id: int, content_type: str = "movie"):
+def trailer_cached(item_id: int, content_type: str = "movie") -> bool:
+    cached = _trailer_cache.get((content_type, str(item_id)))
+    return bool(cached and cached[0] > time.time())
+
+
+def fetch_watch_providers(item_id: int, content_type: str = "movie") -> Optional[Dict]:
+    """
+    Full watch/providers response: {region: {"flatrate": [...], "rent": [...], ...}}.
+    Returns None on errors so callers can tell "no providers" from "unknown".
+    """
     if not TMDB_API_KEY:
-        return []
+        return None
     try:
         url = f"{BASE_URL}/{content_type}/{item_id}/watch/providers?api_key={TMDB_API_KEY}"
-        res = requests.get(url, timeout=5)
+        res = _tmdb_get(url, timeout=5)
         if res.status_code != 200:
-            return []
-        return res.json().get("results", {}).get("SA", {}).get("flatrate", [])
+            return None
+        return res.json().get("results", {}) or {}
     except Exception:
-        logger.exception("get_watch_providers error")
-        return []
+        logger.exception("fetch_watch_providers error")
+        return None
@@ -1,12 +1,24 @@
 # app.py - Flask server (corrected)
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, g, render_template, request, jsonify, url_for
+from werkzeug.middleware.proxy_fix import ProxyFix
+import admission
 import api
 import languages
 import config
-import re
+import jobs
+import prefetch
+import providers
+import titles
+import base64
+import io
+import json
 import os
+import time
 
 app = Flask(__name__, static_folder="static", template_folder="templates")
+# Render's proxy appends the real client address as the last X-Forwarded-For hop;
+# trust exactly that one so request.remote_addr can't be spoofed by the client.
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1)
 app.secret_key = os.environ.get("FLASK_SECRET_KEY") or os.urandom(24)
 
 current_lang = getattr(config, "DEFAULT_LANGUAGE", "ar-SA").split("-")[0]
@@ -14,34 +26,96 @@ current_lang = getattr(config, "DEFAULT_LANGUAGE", "ar-SA").split("-")[0]
 if not getattr(config, "GEMINI_API_KEY", None):
     print("A GEMINI_API_KEY not configured. AI endpoints may return a friendly error or fallback.")
 
-MOVIE_BRACKET_RE = re.compile(r"\[(.*?)\]")
+# Admission control: cheap lookups and expensive AI calls get separate limits.
+ROUTE_CLASSES = {
+    'search': 'cheap', 'browse_content': 'cheap', 'get_details': 'cheap', 'list_providers': 'cheap',
+    'chat': 'expensive', 'analyze_image': 'expensive', 'analyze_dna': 'expensive', 'matchmaker': 'expensive',
+    'job_status': 'cheap', 'job_events': 'stream',
+}
 
 
-def extract_movies_from_text(text):
-    matches = MOVIE_BRACKET_RE.findall(text or "")
-    movies_data = []
+def client_id():
+    return request.remote_addr or "unknown"
+
+
+@app.before_request
+def admit_request():
+    cls = ROUTE_CLASSES.get(request.endpoint)
+    if cls is None:
+        return None
+    try:
+        g.admission = (cls, admission.controller.acquire(cls, client_id()))
+    except admission.AdmissionError as e:
+        # 'response'/'movies' so the page shows a message instead of an empty reply or grid.
+        resp = jsonify({'error': e.reason, 'movies': [],
+                        'response': f"{e.reason}, please try again in {e.retry_after} s."})
+        resp.status_code = e.status
+        resp.headers['Retry-After'] = str(e.retry_after)
+        return resp
+
+
+@app.teardown_request
+def release_request(exc):
+    slot = g.pop('admission', None)
+    if slot:
+        admission.controller.release(*slot)
+
+
+def cards(records):
+    """JSON cards for the records that have a poster."""
+    return [r.to_card(api.IMAGE_URL) for r in records if r.poster_path]
+
+
+def movies_for_titles(refs):
+    found = []
     seen_ids = set()
-    for name in matches:
-        res = api.search_tmdb(name)
-        if res:
-            item = res[0]
-            item_id = item.get("id")
-            if item_id and item_id not in seen_ids and item.get("poster_path"):
-                seen_ids.add(item_id)
-                movies_data.append({
-                    "title": item.get("title") or item.get("name"),
-                    "poster": api.IMAGE_URL + item["poster_path"],
-                    "id": item_id,
-                    "type": "movie" if item.get("title") else "tv",
-                    "overview": item.get("overview", "")
-                })
-    return movies_data
+    for ref in refs:
+        res = api.search_tmdb(ref.title, ref.media_type, year=ref.year)
+        if res and res[0].poster_path and res[0].id not in seen_ids:
+            seen_ids.add(res[0].id)
+            found.append(res[0])
+    return cards(found)
+
+
+def grid_response(body):
+    """jsonify a grid; once it is sent, warm the details of its first cards."""
+    resp = jsonify(body)
+    resp.call_on_close(lambda: prefetch.prefetcher.schedule(body.get('movies') or []))
+    return resp
+
+
+def build_reply(ai_text):
+    """JSON body for an AI reply: structured output when valid, else [Bracket] titles."""
+    text, refs = titles.parse_reply(ai_text)
+    return {'response': text, 'movies': movies_for_titles(refs)}
+
+
+# Rendered index page per language; the template only depends on the language.
+_home_pages = {}
+
+
+def render_home(lang):
+    page = _home_pages.get(lang)
+    if page is None:
+        page = render_template('index.html', t=languages.get_text(lang), lang=lang)
+        _home_pages[lang] = page
+    return page
+
+
+def preload_state():
+    """
+    Build shared read-only state up front (translations, rendered pages).
+    Called by gunicorn before forking workers so they share it copy-on-write.
+    The template uses url_for('static', ...), which needs a request context.
+    """
+    with app.test_request_context('/'):
+        for lang in languages.TRANSLATIONS:
+            render_home(lang)
 
 
 @app.route('/')
 def home():
-    t = languages.get_text(current_lang)
-    return render_template('index.html', t=t, lang=current_lang)
+    return render_home(current_lang)
 
 
 @app.route('/change_lang/<lang>')
@@ -59,7 +133,7 @@ def chat():
         return jsonify({'response': 'Please send a message.', 'movies': []})
     persona = request.form.get('persona', 'Friendly')
     response_text = api.chat_with_ai_formatted([{"role": "user", "content": msg}], persona, current_lang)
-    return jsonify({'response': response_text, 'movies': extract_movies_from_text(response_text)})
+    return grid_response(build_reply(response_text))
 
 
 @app.route('/search', methods=['POST'])
@@ -68,18 +142,7 @@ def search():
     ctype = request.form.get('type')
     if not query:
         return jsonify({'movies': []})
-    results = api.search_tmdb(query, ctype)
-    movies = []
-    for item in results:
-        if item.get('poster_path'):
-            movies.append({
-                "title": item.get('title') or item.get('name'),
-                "poster": api.IMAGE_URL + item['poster_path'],
-                "id": item['id'],
-                "type": 'movie' if item.get('title') else 'tv',
-                "overview": item.get('overview', "")
-            })
-    return jsonify({'movies': movies})
+    return jsonify({'movies': cards(api.search_tmdb(query, ctype))})
 
 
 @app.route('/browse_content', methods=['POST'])
@@ -87,17 +150,65 @@ def browse_content():
     content_type = request.form.get('type', 'movie')
     category = request.form.get('category', 'popular')
     results = api.fetch_content(content_type, category)
+    # "available on my services": comma-separated TMDB provider ids, filtered locally
+    only = [int(p) for p in request.form.get('providers', "").split(',') if p.strip().isdigit()]
+    if not only:
+        return grid_response({'movies': cards(results)})
+    # Fetch the grid's missing providers within a short budget; items still
+    # unfetched after it stay in, marked "unknown".
+    providers.store.fill(results)
     movies = []
-    for item in results:
-        if item.get('poster_path'):
-            movies.append({
-                "title": item.get('title') or item.get('name'),
-                "poster": api.IMAGE_URL + item['poster_path'],
-                "id": item['id'],
-                "type": content_type,
-                "overview": item.get('overview', "")
-            })
-    return jsonify({'movies': movies})
+    for item, availability in providers.store.filter_items(results, only, providers.region_for(current_lang)):
+        if item.poster_path:
+            movies.append(dict(item.to_card(api.IMAGE_URL), availability=availability))
+    return grid_response({'movies': movies})
+
+
+# --- AI analyses: run inline, or as background jobs when the client sends async=1 ---
+
+class AnalysisFailed(jobs.JobFailed):
+    """The AI call returned an error reply; a job raising this ends up failed, not cached."""
+
+
+def analysis_reply(ai_text):
+    if api.is_error_reply(ai_text):
+        raise AnalysisFailed(ai_text)
+    return build_reply(ai_text)
+
+
+def run_analyze_image(payload):
+    ai_text = api.analyze_image_search(io.BytesIO(base64.b64decode(payload['image'])), payload['lang'])
+    return analysis_reply(ai_text)
+
+
+def run_analyze_dna(payload):
+    ai_text = api.analyze_dna(payload['movies'], payload['lang'])
+    return analysis_reply(ai_text)
+
+
+def run_matchmaker(payload):
+    ai_text = api.find_match(payload['u1'], payload['u2'], payload['lang'])
+    return analysis_reply(ai_text)
+
+
+jobs.queue.register('analyze_image', run_analyze_image)
+jobs.queue.register('analyze_dna', run_analyze_dna)
+jobs.queue.register('matchmaker', run_matchmaker)
+
+
+def dispatch(kind, handler, payload):
+    if request.values.get('async') not in ('1', 'true'):
+        try:
+            return jsonify(handler(payload))
+        except AnalysisFailed as e:
+            return jsonify({'response': str(e), 'movies': []})
+    try:
+        priority = max(0, min(9, int(request.values.get('priority', 5))))
+    except ValueError:
+        priority = 5
+    job_id = jobs.queue.submit(kind, payload, priority)
+    return jsonify({'job_id': job_id, 'status_url': url_for('job_status', job_id=job_id),
+                    'events_url': url_for('job_events', job_id=job_id)}), 202
 
 
 @app.route('/analyze_image', methods=['POST'])
@@ -109,38 +220,92 @@ def analyze_image():
         return jsonify({'error': 'No selection'}), 400
     if not file.filename.lower().endswith(('.png', '.jpg', '.jpeg', '.webp')):
         return jsonify({'error': 'Invalid file type'}), 400
-    ai_text = api.analyze_image_search(file, current_lang)
-    return jsonify({'response': ai_text, 'movies': extract_movies_from_text(ai_text)})
+    image = base64.b64encode(file.read()).decode('ascii')
+    return dispatch('analyze_image', run_analyze_image, {'image': image, 'lang': current_lang})
 
 
 @app.route('/analyze_dna', methods=['POST'])
 def analyze_dna():
     movies = [request.form.get('m1', ""), request.form.get('m2', ""), request.form.get('m3', "")]
-    ai_text = api.analyze_dna(movies, current_lang)
-    return jsonify({'response': ai_text, 'movies': extract_movies_from_text(ai_text)})
+    return dispatch('analyze_dna', run_analyze_dna, {'movies': movies, 'lang': current_lang})
 
 
 @app.route('/matchmaker', methods=['POST'])
 def matchmaker():
     u1 = request.form.get('u1', "")
     u2 = request.form.get('u2', "")
-    ai_text = api.find_match(u1, u2, current_lang)
-    return jsonify({'response': ai_text, 'movies': extract_movies_from_text(ai_text)})
+    return dispatch('matchmaker', run_matchmaker, {'u1': u1, 'u2': u2, 'lang': current_lang})
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = jobs.queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    return jsonify(job)
+
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """
+    Server-sent events: one event per status change, closed when the job ends.
+    Each open stream holds a request thread, so this relies on the threaded
+    workers configured in gunicorn.conf.py; clients can always poll /jobs/<id>.
+    """
+    def stream():
+        last = None
+        deadline = time.time() + 120  # clients reconnect after this
+        while time.time() < deadline:
+            job = jobs.queue.get(job_id)
+            if job is None:
+                yield 'event: error\ndata: {"error": "Unknown or expired job"}\n\n'
+                return
+            if job['status'] != last:
+                last = job['status']
+                yield f"data: {json.dumps(job)}\n\n"
+            if last in (jobs.DONE, jobs.FAILED):
+                return
+            time.sleep(jobs.POLL_INTERVAL)
+    resp = Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+    # The stream outlives the request context; hold the admission slot until it closes.
+    slot = g.pop('admission', None)
+    if slot:
+        resp.call_on_close(lambda: admission.controller.release(*slot))
+    return resp
 
 
 @app.route('/get_details', methods=['POST'])
 def get_details():
     mid = request.form.get('id')
     mtype = request.form.get('type', 'movie')
-    providers = api.get_watch_providers(mid, mtype)
+    region = request.form.get('region') or providers.region_for(current_lang)
+    prefetch.prefetcher.record_open(mid, mtype)
+    provs = providers.store.get(mid, mtype, region) if mid and mid.isdigit() else []
     clean_provs = []
-    if providers:
-        for p in providers:
+    if provs:
+        for p in provs:
             if p.get('logo_path'):
                 clean_provs.append({'name': p.get('provider_name'), 'logo': api.IMAGE_URL + p['logo_path']})
     trailer = api.get_trailer(mid, mtype)
     return jsonify({'providers': clean_provs, 'trailer': trailer})
 
 
+@app.route('/providers', methods=['GET'])
+def list_providers():
+    region = request.args.get('region') or providers.region_for(current_lang)
+    provs = [{'id': p['id'], 'name': p['name'], 'count': p['count'],
+              'logo': api.IMAGE_URL + p['logo_path'] if p.get('logo_path') else None}
+             for p in providers.store.providers_in(region)]
+    return jsonify({'region': region, 'providers': provs})
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return jsonify({'admission': admission.controller.stats(),
+                    'prefetch': prefetch.prefetcher.stats(),
+                    'providers': providers.store.stats(),
+                    'caches': {'content': api.content_cache.stats(), 'search': api.search_cache.stats()}})
+
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
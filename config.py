@@ -1,7 +1,10 @@
 import os
-from dotenv import load_dotenv
 
-load_dotenv()
+# .env is a local-development convenience; on Render the variables come from
+# the environment, so skip importing python-dotenv when there is no file.
+if os.path.exists(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env")):
+    from dotenv import load_dotenv
+    load_dotenv()
 
 # API Keys
 TMDB_API_KEY = os.getenv("TMDB_API_KEY")
@@ -11,3 +14,10 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 # App Settings
 BASE_URL = os.getenv("BASE_URL", "https://api.themoviedb.org/3")
 IMAGE_URL = os.getenv("IMAGE_URL", "https://image.tmdb.org/t/p/w500")
+
+# AI replies as compact JSON (titles/year/type + commentary) instead of [Brackets]
+STRUCTURED_OUTPUT = os.getenv("STRUCTURED_OUTPUT", "0").lower() in ("1", "true", "yes")
+
+# Speculative prefetch of details (providers/trailer) for the first grid cards
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "0").lower() in ("1", "true", "yes")
+PREFETCH_TOP_K = int(os.getenv("PREFETCH_TOP_K", "4"))
@@ -0,0 +1,19 @@
+# gunicorn.conf.py - picked up automatically by `gunicorn app:app`
+
+import os
+
+# Threads let the admission controller queue and prioritise requests within a
+# worker, and keep /jobs/<id>/events (SSE) streams from holding a whole process;
+# with the default sync worker each process serves one request at a time.
+# admission.py keeps ADMISSION_CHEAP_RESERVE of these threads for cheap routes.
+workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+threads = int(os.environ.get("GUNICORN_THREADS", 12))
+
+# Import the app once in the master and fork workers from it.
+preload_app = True
+
+
+def when_ready(server):
+    # Runs in the master after the app is loaded and before workers are forked.
+    import app
+    app.preload_state()
@@ -0,0 +1,209 @@
+# jobs.py - background job queue for long-running AI analyses
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Optional
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# SQLite file shared by every gunicorn worker on the instance; any worker can
+# run a job and any worker can answer a poll for it.
+JOBS_DB = getattr(config, "JOBS_DB", None) or os.path.join(tempfile.gettempdir(), "cimabot_jobs.sqlite3")
+JOB_WORKERS = int(getattr(config, "JOB_WORKERS", 2))
+JOB_RESULT_TTL = int(getattr(config, "JOB_RESULT_TTL", 3600))
+# Running jobs older than this belong to a worker that died; requeue them.
+JOB_STALE_AFTER = int(getattr(config, "JOB_STALE_AFTER", 300))
+POLL_INTERVAL = 0.5
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    dedupe_key TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 5,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    expires REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, priority DESC, created);
+CREATE INDEX IF NOT EXISTS jobs_dedupe ON jobs (dedupe_key);
+"""
+
+
+class JobFailed(Exception):
+    """Raised by a handler for an expected failure: the job fails with this message, logged without a traceback."""
+
+
+class JobQueue:
+    """
+    Priority queue persisted in SQLite and drained by a local pool of worker
+    threads. Identical submissions (same kind and payload) share one job
+    while it is pending or its result is still fresh.
+    """
+
+    def __init__(self, path: str = JOBS_DB, workers: int = JOB_WORKERS, result_ttl: int = JOB_RESULT_TTL):
+        self.path = path
+        self.workers = workers
+        self.result_ttl = result_ttl
+        self._handlers: Dict[str, Callable[[Dict], Dict]] = {}
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._pid = None
+        self._schema_ready = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        if not self._schema_ready:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            self._schema_ready = True
+        return conn
+
+    def register(self, kind: str, handler: Callable[[Dict], Dict]):
+        """handler(payload) -> JSON-serialisable result."""
+        self._handlers[kind] = handler
+
+    # -- workers -----------------------------------------------------------
+
+    def start(self):
+        """Start worker threads in this process (idempotent, fork-aware)."""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._threads = []
+            for i in range(self.workers):
+                t = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _claim(self) -> Optional[sqlite3.Row]:
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM jobs WHERE expires IS NOT NULL AND expires < ?", (now,))
+            conn.execute("UPDATE jobs SET status = ?, started = NULL WHERE status = ? AND started < ?",
+                         (QUEUED, RUNNING, now - JOB_STALE_AFTER))
+            row = conn.execute("SELECT * FROM jobs WHERE status = ? ORDER BY priority DESC, created LIMIT 1",
+                               (QUEUED,)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE jobs SET status = ?, started = ? WHERE id = ?", (RUNNING, now, row["id"]))
+            conn.execute("COMMIT")
+            return row
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _finish(self, job_id: str, result=None, error: Optional[str] = None):
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("UPDATE jobs SET status = ?, result = ?, error = ?, finished = ?, expires = ? WHERE id = ?",
+                         (FAILED if error else DONE, json.dumps(result) if result is not None else None,
+                          error, now, now + self.result_ttl, job_id))
+        finally:
+            conn.close()
+
+    def _work(self):
+        while True:
+            try:
+                row = self._claim()
+            except Exception:
+                logger.exception("Job queue claim error")
+                row = None
+            if row is None:
+                self._wake.wait(POLL_INTERVAL * 4)
+                self._wake.clear()
+                continue
+            handler = self._handlers.get(row["kind"])
+            if handler is None:
+                self._fail(row["id"], f"Unknown job kind: {row['kind']}")
+                continue
+            try:
+                self._finish(row["id"], result=handler(json.loads(row["payload"])))
+            except JobFailed as e:
+                logger.warning("Job %s (%s) failed: %s", row["id"], row["kind"], e)
+                self._fail(row["id"], str(e) or e.__class__.__name__)
+            except Exception as e:
+                logger.exception("Job %s (%s) failed", row["id"], row["kind"])
+                self._fail(row["id"], str(e) or e.__class__.__name__)
+
+    def _fail(self, job_id: str, error: str):
+        # Never let a DB error here end the worker thread; the job is
+        # re-queued once it counts as stale.
+        try:
+            self._finish(job_id, error=error)
+        except Exception:
+            logger.exception("Could not record failure of job %s", job_id)
+
+    # -- client side -------------------------------------------------------
+
+    def submit(self, kind: str, payload: Dict, priority: int = 5) -> str:
+        """Queue a job and return its id (or the id of an identical pending/fresh job)."""
+        self.start()
+        body = json.dumps(payload, sort_keys=True)
+        dedupe_key = hashlib.sha256(f"{kind}\0{body}".encode("utf-8")).hexdigest()
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE dedupe_key = ? AND status != ? AND (expires IS NULL OR expires > ?) "
+                "ORDER BY created DESC LIMIT 1", (dedupe_key, FAILED, now)).fetchone()
+            if row is not None:
+                job_id = row["id"]
+                # A higher-priority duplicate bumps the pending job.
+                conn.execute("UPDATE jobs SET priority = MAX(priority, ?) WHERE id = ? AND status = ?",
+                             (priority, job_id, QUEUED))
+            else:
+                job_id = uuid.uuid4().hex
+                conn.execute("INSERT INTO jobs (id, kind, payload, dedupe_key, priority, status, created) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?)", (job_id, kind, body, dedupe_key, priority, QUEUED, now))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        self._wake.set()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """Public view of a job, or None if unknown or expired."""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None or (row["expires"] and row["expires"] < time.time()):
+            return None
+        job = {"id": row["id"], "kind": row["kind"], "status": row["status"], "priority": row["priority"],
+               "created": row["created"], "started": row["started"], "finished": row["finished"]}
+        if row["status"] == DONE:
+            job["result"] = json.loads(row["result"]) if row["result"] else None
+        elif row["status"] == FAILED:
+            job["error"] = row["error"]
+        return job
+
+
+queue = JobQueue()
@@ -1,11 +1,12 @@
+import functools
 import streamlit as st
-from st_clickable_images import clickable_images
 from streamlit_option_menu import option_menu
 import config
 import styles
 import api
 import languages
-import re 
+import providers
+import titles
 
 # --- 1. إعدادات الصفحة (يجب أن تكون أول سطر) ---
 st.set_page_config(page_title="AI Cinema Hub", page_icon="🔮", layout="wide")
@@ -57,7 +58,7 @@ if st.session_state.page != current_query:
 # تهيئة الرسائل (إذا لم تكن موجودة)
 if "messages" not in st.session_state: 
     # الافتراضي: رسالة الشخصية الأولى
-    st.session_state.messages = [{"role": "assistant", "content": T['welcome_msgs'][0]}]
+    st.session_state.messages = [{"role": "assistant", "content": T['welcome_msgs'][0], "media": []}]
 
 # --- 2. القائمة العلوية (Top Navigation) ---
 # تحديد التبويب النشط بناءً على الصفحة الحالية
@@ -94,37 +95,101 @@ elif selected_nav == T['menu'][6]: update_url("library"); st.rerun()
 
 st.markdown("---")
 
+# --- 3. المحللات المخزنة (Cached resolvers) ---
+# كل تفاعل يعيد تنفيذ الملف من البداية، لذلك نخزن نتائج TMDB مع اللغة كجزء من المفتاح
+# دوال api ترجع [] أو None عند الفشل (مهلة، 429...)، فلا نخزن النتائج الفارغة هنا:
+# st.cache_data لا يخزن استدعاءً رفع استثناء، والنتيجة الفارغة الناجحة مخزنة أصلاً في كاش api
+class _Uncached(Exception):
+    def __init__(self, value):
+        super().__init__()
+        self.value = value
+
+def _nonempty(value):
+    if not value:
+        raise _Uncached(value)
+    return value
+
+def uncached_if_empty(fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        try:
+            return fn(*args, **kwargs)
+        except _Uncached as e:
+            return e.value
+    return wrapper
+
+@uncached_if_empty
+@st.cache_data(ttl=6 * 3600, show_spinner=False)
+def resolve_title(title, year, media_type, lang):
+    """أول نتيجة TMDB (مع بوستر) لعنوان واحد"""
+    res = api.search_tmdb(title, media_type, language=api.tmdb_language(lang), year=year)
+    return _nonempty(res[0] if res and res[0].poster_path else None)
+
+@uncached_if_empty
+@st.cache_data(ttl=3600, show_spinner=False)
+def cached_search(query, content_type, lang):
+    return _nonempty(api.search_tmdb(query, content_type, language=api.tmdb_language(lang)))
+
+@uncached_if_empty
+@st.cache_data(ttl=3600, show_spinner=False)
+def cached_browse(content_type, category, lang):
+    return _nonempty(api.fetch_content(content_type, category, language=api.tmdb_language(lang)))
+
+@uncached_if_empty
+@st.cache_data(ttl=24 * 3600, show_spinner=False)
+def cached_trailer(item_id, content_type):
+    return _nonempty(api.get_trailer(item_id, content_type))
+
+def resolve_media(refs, lang):
+    """تحويل العناوين المستخرجة إلى عناصر TMDB (بدون تكرار)"""
+    media, seen = [], set()
+    for ref in refs:
+        item = resolve_title(ref.title, ref.year, ref.media_type, lang)
+        if item and item.id not in seen:
+            seen.add(item.id)
+            media.append(item)
+    return media
+
+def make_reply(raw):
+    """رسالة المساعد مع الوسائط المحللة مرة واحدة عند إنشائها (JSON منظم أو [أقواس])"""
+    content, refs = titles.parse_reply(raw)
+    # في الوضع المنظم التعليق لا يحتوي العناوين؛ نضيفها بصيغة [Title (year)] حتى يعرف النموذج ما اقترحه سابقاً
+    listed = {r.key for r in titles.parse_titles(content)}
+    missing = [r for r in refs if r.key not in listed]
+    if missing:
+        content = f"{content}\n\n{titles.format_refs(missing)}".strip()
+    return {"role": "assistant", "content": content, "media": resolve_media(refs, st.session_state.language)}
+
 # --- 4. الدوال المساعدة ---
 
-def extract_and_display_media(text, idx):
-    """استخراج وعرض الأفلام من ردود الذكاء الاصطناعي"""
-    st.markdown(text)
-    matches = re.findall(r'\[(.*?)\]', text)
-    if matches:
+def extract_and_display_media(msg, idx):
+    """عرض رد الذكاء الاصطناعي مع الأفلام المخزنة في الرسالة"""
+    st.markdown(msg["content"])
+    if "media" not in msg:
+        # رسائل قديمة بدون وسائط: نحللها مرة واحدة ونحفظها
+        msg["media"] = resolve_media(titles.parse_titles(msg["content"]), st.session_state.language)
+    media = msg["media"]
+    if media:
         st.markdown("---")
-        cols = st.columns(len(matches))
-        for i, m in enumerate(matches):
-            res = api.search_tmdb(m)
-            if res:
-                item = res[0]
-                if item.get('poster_path'):
-                    with cols[i % 3]:
-                        st.image(config.IMAGE_URL + item['poster_path'], use_container_width=True)
-                        # مفتاح فريد للزر
-                        if st.button(f"⬅️", key=f"btn_{item['id']}_{idx}_{i}"):
-                            st.session_state.selected_movie = item
-                            update_url("details")
-                            st.rerun()
+        cols = st.columns(len(media))
+        for i, item in enumerate(media):
+            with cols[i]:
+                st.image(config.IMAGE_URL + item.poster_path, use_container_width=True)
+                # مفتاح فريد للزر
+                if st.button(f"⬅️", key=f"btn_{item.id}_{idx}_{i}"):
+                    st.session_state.selected_movie = item
+                    update_url("details")
+                    st.rerun()
 
 def show_grid(items):
     """عرض شبكة الأفلام"""
     if not items: st.warning("No results."); return
-    imgs, names = [], []
-    for it in items:
-        if it.get('poster_path'):
-            imgs.append(config.IMAGE_URL + it['poster_path'])
-            names.append(it.get('title') or it.get('name'))
+    shown = [it for it in items if it.poster_path]
+    imgs = [config.IMAGE_URL + it.poster_path for it in shown]
+    names = [it.title for it in shown]
     if imgs:
+        # استيراد متأخر: المكون يُحمّل فقط في الصفحات التي تعرض شبكة
+        from st_clickable_images import clickable_images
         clk = clickable_images(
             imgs, titles=names,
             div_style={"display": "flex", "justify-content": "center", "flex-wrap": "wrap", "gap": "15px", "padding": "10px"},
@@ -132,18 +197,35 @@ def show_grid(items):
             key=f"grid_{st.session_state.page}_{len(items)}"
         )
         if clk > -1:
-            # البحث عن العنصر الصحيح في القائمة الأصلية
-            target_img = imgs[clk]
-            original_item = None
-            for it in items:
-                if it.get('poster_path') and (config.IMAGE_URL + it['poster_path']) == target_img:
-                    original_item = it
-                    break
-            
-            if original_item:
-                st.session_state.selected_movie = original_item
-                update_url("details")
-                st.rerun()
+            st.session_state.selected_movie = shown[clk]
+            update_url("details")
+            st.rerun()
+
+# --- أجزاء مستقلة (Fragments): تفاعلها يعيد تنفيذ الجزء فقط وليس الصفحة كاملة ---
+
+@st.fragment
+def favorite_button(item):
+    is_fav = any(f.id==item.id for f in st.session_state.favorites)
+    if st.button(T['fav_rem'] if is_fav else T['fav_add'], use_container_width=True):
+        if is_fav: st.session_state.favorites = [f for f in st.session_state.favorites if f.id!=item.id]
+        else: st.session_state.favorites.append(item)
+        st.rerun(scope="fragment")
+
+@st.fragment
+def browse_grid():
+    c1, c2 = st.columns([1, 3])
+    with c1: 
+        sort = st.selectbox(T['sort_label'], T['sort_opts'])
+        # Map sort back to API keys
+        cat = "popular"
+        if sort == T['sort_opts'][1]: cat = "top_rated"
+        elif sort == T['sort_opts'][2]: cat = "now_playing" if st.session_state.content_type=="movie" else "on_the_air"
+    
+    with c2: search = st.text_input(T['search_placeholder'])
+    
+    if search: res = cached_search(search, st.session_state.content_type, st.session_state.language)
+    else: res = cached_browse(st.session_state.content_type, cat, st.session_state.language)
+    show_grid(res)
 
 # --- 5. الصفحات ---
 
@@ -165,14 +247,14 @@ if st.session_state.page == "chat_home":
                 except:
                     custom_welcome = T['welcome_msgs'][0]
                 
-                st.session_state.messages.append({"role": "assistant", "content": custom_welcome})
+                st.session_state.messages.append({"role": "assistant", "content": custom_welcome, "media": []})
                 st.rerun()
     
     # عرض الرسائل
     for i, msg in enumerate(st.session_state.messages):
         if msg["role"] != "system":
             with st.chat_message(msg["role"]):
-                if msg["role"] == "assistant": extract_and_display_media(msg["content"], i)
+                if msg["role"] == "assistant": extract_and_display_media(msg, i)
                 else: st.write(msg["content"])
     
     # إدخال المستخدم
@@ -181,9 +263,9 @@ if st.session_state.page == "chat_home":
         with st.chat_message("user"): st.write(p)
         with st.chat_message("assistant"):
             with st.spinner("..."):
-                r = api.chat_with_ai_formatted(st.session_state.messages, persona, st.session_state.language)
+                r = make_reply(api.chat_with_ai_formatted(st.session_state.messages, persona, st.session_state.language))
                 extract_and_display_media(r, len(st.session_state.messages))
-                st.session_state.messages.append({"role": "assistant", "content": r})
+                st.session_state.messages.append(r)
 
 # 2. المحقق البصري
 elif st.session_state.page == "visual_detective":
@@ -197,7 +279,7 @@ elif st.session_state.page == "visual_detective":
             st.image(up, use_container_width=True)
             if st.button(T['analyze_btn'], use_container_width=True):
                 with st.spinner("..."): 
-                    st.session_state.visual_result = api.analyze_image_search(up, st.session_state.language)
+                    st.session_state.visual_result = make_reply(api.analyze_image_search(up, st.session_state.language))
     with c2:
         if st.session_state.visual_result: 
             st.success(T['success_analysis'])
@@ -214,7 +296,7 @@ elif st.session_state.page == "dna_analysis":
         if st.button(T['analyze_dna_btn'], use_container_width=True):
             if m1 and m2 and m3:
                 with st.spinner("..."): 
-                    st.session_state.dna_result = api.analyze_dna([m1, m2, m3], st.session_state.language)
+                    st.session_state.dna_result = make_reply(api.analyze_dna([m1, m2, m3], st.session_state.language))
     with c2:
         if st.session_state.dna_result: 
             st.success(T['success_analysis'])
@@ -232,7 +314,7 @@ elif st.session_state.page == "matchmaker":
     if st.button(T['match_btn'], use_container_width=True):
         if u1 and u2:
             with st.spinner("..."): 
-                st.session_state.match_result = api.find_match(u1, u2, st.session_state.language)
+                st.session_state.match_result = make_reply(api.find_match(u1, u2, st.session_state.language))
     
     if st.session_state.match_result: 
         st.success(T['success_match'])
@@ -244,17 +326,18 @@ elif st.session_state.page == "details":
     if item:
         if st.button(T['back_btn']): update_url("chat_home"); st.rerun()
         
-        if item.get('backdrop_path'): 
-            st.image(config.BACKDROP_URL + item['backdrop_path'], use_container_width=True)
+        if item.backdrop_path: 
+            st.image(config.BACKDROP_URL + item.backdrop_path, use_container_width=True)
         
-        st.markdown(f"<h1 style='text-align: center;'>{item.get('title') or item.get('name')}</h1>", unsafe_allow_html=True)
+        st.markdown(f"<h1 style='text-align: center;'>{item.title}</h1>", unsafe_allow_html=True)
         
         c1, c2 = st.columns([1, 2])
         with c1: 
-            if item.get('poster_path'): st.image(config.IMAGE_URL + item['poster_path'], use_container_width=True)
+            if item.poster_path: st.image(config.IMAGE_URL + item.poster_path, use_container_width=True)
             
             st.markdown(f"**{T['providers']}**")
-            provs = api.get_watch_providers(item['id'], 'movie' if item.get('title') else 'tv')
+            # مخزن المنصات يحفظ كل المناطق، والمنطقة تؤخذ من لغة المستخدم
+            provs = providers.store.get(item.id, item.media_type, providers.region_for(st.session_state.language))
             if provs:
                 cols = st.columns(len(provs))
                 for i, p in enumerate(provs): 
@@ -264,18 +347,12 @@ elif st.session_state.page == "details":
                 st.caption(T['no_providers'])
             
             st.markdown("---")
-            is_fav = any(f['id']==item['id'] for f in st.session_state.favorites)
-            if st.button(T['fav_rem'] if is_fav else T['fav_add'], use_container_width=True):
-                if is_fav: st.session_state.favorites = [f for f in st.session_state.favorites if f['id']!=item['id']]
-                else: 
-                    item['media_type'] = 'movie' if item.get('title') else 'tv'
-                    st.session_state.favorites.append(item)
-                st.rerun()
+            favorite_button(item)
         
         with c2:
             st.subheader(T['story'])
-            st.write(item.get('overview'))
-            tr = api.get_trailer(item['id'], 'movie' if item.get('title') else 'tv')
+            st.write(item.overview)
+            tr = cached_trailer(item.id, item.media_type)
             if tr: 
                 st.markdown(f"### {T['trailer']}")
                 st.video(tr)
@@ -284,20 +361,7 @@ elif st.session_state.page == "details":
 elif st.session_state.page == "browse":
     t_type = T['browse_movies'] if st.session_state.content_type == "movie" else T['browse_tv']
     st.markdown(f"<h2 style='text-align: center;'>{t_type}</h2>", unsafe_allow_html=True)
-    
-    c1, c2 = st.columns([1, 3])
-    with c1: 
-        sort = st.selectbox(T['sort_label'], T['sort_opts'])
-        # Map sort back to API keys
-        cat = "popular"
-        if sort == T['sort_opts'][1]: cat = "top_rated"
-        elif sort == T['sort_opts'][2]: cat = "now_playing" if st.session_state.content_type=="movie" else "on_the_air"
-    
-    with c2: search = st.text_input(T['search_placeholder'])
-    
-    if search: res = api.search_tmdb(search, st.session_state.content_type)
-    else: res = api.fetch_content(st.session_state.content_type, cat)
-    show_grid(res)
+    browse_grid()
 
 # 7. المكتبة (Library)
 elif st.session_state.page == "library":
@@ -0,0 +1,130 @@
+# prefetch.py - speculative warm-up of the details view for grid results
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Tuple
+
+import api
+import config
+import providers
+
+logger = logging.getLogger(__name__)
+
+PREFETCH_ENABLED = getattr(config, "PREFETCH_ENABLED", False)
+PREFETCH_TOP_K = int(getattr(config, "PREFETCH_TOP_K", 4))
+# Per grid response: stop warming once this many seconds have passed.
+PREFETCH_BUDGET = float(getattr(config, "PREFETCH_BUDGET", 3.0))
+# Queued + running prefetches; anything beyond this is dropped (upstream pressure).
+PREFETCH_MAX_INFLIGHT = int(getattr(config, "PREFETCH_MAX_INFLIGHT", 8))
+# A warmed item not opened within this window counts as waste.
+PREFETCH_HIT_WINDOW = int(getattr(config, "PREFETCH_HIT_WINDOW", 600))
+
+ItemKey = Tuple[str, str]  # (content_type, item_id)
+
+
+class Prefetcher:
+    """
+    After a grid is returned, fetch providers and trailer for its top-K
+    cards in the background so the likely /get_details call is a cache hit.
+    """
+
+    def __init__(self, enabled: bool = PREFETCH_ENABLED, top_k: int = PREFETCH_TOP_K,
+                 budget: float = PREFETCH_BUDGET, max_inflight: int = PREFETCH_MAX_INFLIGHT,
+                 hit_window: int = PREFETCH_HIT_WINDOW):
+        self.enabled = enabled
+        self.top_k = top_k
+        self.budget = budget
+        self.max_inflight = max_inflight
+        self.hit_window = hit_window
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._inflight = 0
+        self._warmed: Dict[ItemKey, float] = {}  # key -> warmed_at, until opened or aged out
+        self._stats = {"scheduled": 0, "warmed": 0, "already_cached": 0, "cancelled": 0,
+                       "errors": 0, "hits": 0, "wasted": 0}
+
+    def _pool(self):
+        # Created lazily, and again after a fork (gunicorn preload).
+        if self._executor is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="prefetch")
+        return self._executor
+
+    def _count(self, name: str, n: int = 1):
+        with self._lock:
+            self._stats[name] += n
+
+    def schedule(self, movies: Iterable[Dict]):
+        """Queue the top-K grid items ({'id', 'type'}) for warming."""
+        if not self.enabled:
+            return
+        keys = []
+        for m in movies:
+            if len(keys) >= self.top_k:
+                break
+            if m.get("id"):
+                keys.append((m.get("type") or "movie", str(m["id"])))
+        if not keys:
+            return
+        deadline = time.time() + self.budget
+        with self._lock:
+            pool = self._pool()
+            room = max(0, self.max_inflight - self._inflight)
+            self._stats["scheduled"] += len(keys)
+            self._stats["cancelled"] += max(0, len(keys) - room)
+            keys = keys[:room]
+            self._inflight += len(keys)
+        for key in keys:
+            pool.submit(self._warm, key, deadline)
+
+    def _warm(self, key: ItemKey, deadline: float):
+        content_type, item_id = key
+        try:
+            if time.time() > deadline or api.tmdb_throttled():
+                self._count("cancelled")
+                return
+            if providers.store.peek(item_id, content_type) is not None and api.trailer_cached(item_id, content_type):
+                self._count("already_cached")
+                return
+            if providers.store.results(item_id, content_type) is None:
+                self._count("errors")  # fetch failed; nothing was warmed
+                return
+            api.get_trailer(item_id, content_type)
+            with self._lock:
+                self._expire_locked(time.time())
+                self._warmed[key] = time.time()
+                self._stats["warmed"] += 1
+        except Exception:
+            logger.exception("Prefetch error for %s", key)
+            self._count("errors")
+        finally:
+            with self._lock:
+                self._inflight -= 1
+
+    def record_open(self, item_id, content_type: str = "movie"):
+        """Called by /get_details: counts a hit if the item was warmed for it."""
+        with self._lock:
+            if self._warmed.pop((content_type, str(item_id)), None) is not None:
+                self._stats["hits"] += 1
+
+    def _expire_locked(self, now: float):
+        for key, warmed_at in list(self._warmed.items()):
+            if now - warmed_at > self.hit_window:
+                del self._warmed[key]
+                self._stats["wasted"] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            self._expire_locked(time.time())
+            s = dict(self._stats, inflight=self._inflight, pending=len(self._warmed),
+                     enabled=self.enabled, top_k=self.top_k)
+        settled = s["hits"] + s["wasted"]
+        s["hit_ratio"] = round(s["hits"] / settled, 3) if settled else None
+        s["waste_ratio"] = round(s["wasted"] / settled, 3) if settled else None
+        return s
+
+
+prefetcher = Prefetcher()
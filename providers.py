@@ -0,0 +1,260 @@
+# providers.py - watch-provider availability store
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import api
+import config
+from records import MediaRecord
+
+logger = logging.getLogger(__name__)
+
+# Provider catalogues change roughly daily; titles with no providers yet
+# (new releases) are re-checked sooner, failures are not stored at all.
+PROVIDER_TTL = getattr(config, "PROVIDER_TTL", 24 * 3600)
+EMPTY_PROVIDER_TTL = getattr(config, "EMPTY_PROVIDER_TTL", 6 * 3600)
+# Per-worker memory budget for stored (trimmed) responses.
+MAX_BYTES = getattr(config, "PROVIDER_STORE_BYTES", 8 * 1024 * 1024)
+# Filling a filtered grid: wait at most FILL_BUDGET seconds for missing items
+# (the rest finish in the background) and keep at most FILL_MAX_INFLIGHT fetches.
+FILL_BUDGET = float(getattr(config, "PROVIDER_FILL_BUDGET", 1.5))
+FILL_MAX_INFLIGHT = int(getattr(config, "PROVIDER_FILL_MAX_INFLIGHT", 20))
+FILL_WORKERS = 4
+
+# Offer kinds that count as "available on my services"; the only ones stored.
+INDEXED_KINDS = ("flatrate", "free", "ads")
+PROVIDER_FIELDS = ("provider_id", "provider_name", "logo_path")
+
+ItemKey = Tuple[str, int]  # (content_type, item_id)
+
+
+def region_for(lang: str) -> str:
+    """Watch region (ISO 3166-1) for a UI language, taken from its TMDB locale."""
+    return api.tmdb_language(lang).split("-")[-1]
+
+
+def trim(results: Dict) -> Dict:
+    """
+    Keep only what the store reads: the INDEXED_KINDS offers per region with
+    provider id, name and logo (TMDB's full response is mostly rent/buy lists
+    and links, hundreds of KB per title).
+    """
+    trimmed = {}
+    for region, offers in (results or {}).items():
+        kept = {}
+        for kind in INDEXED_KINDS:
+            entries = [{f: sys.intern(p[f]) if isinstance(p.get(f), str) else p.get(f) for f in PROVIDER_FIELDS}
+                       for p in (offers or {}).get(kind) or [] if p.get("provider_id") is not None]
+            if entries:
+                kept[kind] = entries
+        if kept:
+            trimmed[sys.intern(region)] = kept
+    return trimmed
+
+
+def results_nbytes(results: Dict) -> int:
+    size = sys.getsizeof(results)
+    for offers in results.values():
+        size += sys.getsizeof(offers)
+        for entries in offers.values():
+            size += sys.getsizeof(entries) + sum(sys.getsizeof(p) for p in entries)
+    return size
+
+
+class ProviderStore:
+    """
+    Keeps the full multi-region watch/providers response per item and an
+    inverted index region -> provider_id -> items, so availability filters
+    run locally without further TMDB calls. Responses are trimmed to the
+    indexed offer kinds and the store is bounded by bytes.
+    """
+
+    def __init__(self, ttl: int = PROVIDER_TTL, empty_ttl: int = EMPTY_PROVIDER_TTL, max_bytes: int = MAX_BYTES,
+                 fill_budget: float = FILL_BUDGET, fill_max_inflight: int = FILL_MAX_INFLIGHT):
+        self.ttl = ttl
+        self.empty_ttl = empty_ttl
+        self.max_bytes = max_bytes
+        self.fill_budget = fill_budget
+        self.fill_max_inflight = fill_max_inflight
+        self.bytes = 0
+        self._lock = threading.Lock()
+        self._items: Dict[ItemKey, Tuple[float, Dict, int]] = {}  # key -> (expires_at, results, nbytes)
+        self._index: Dict[str, Dict[int, set]] = {}
+        self._names: Dict[int, Tuple[str, Optional[str]]] = {}  # provider_id -> (name, logo_path)
+        self._pending: set = set()  # keys being fetched by fill()
+        self._executor = None
+        self._pid = None
+
+    # -- reads -------------------------------------------------------------
+
+    def _fresh(self, key: ItemKey) -> Optional[Dict]:
+        with self._lock:
+            entry = self._items.get(key)
+            if entry and entry[0] > time.time():
+                return entry[1]
+            return None
+
+    def results(self, item_id: int, content_type: str = "movie") -> Optional[Dict]:
+        """All regions for an item, fetching from TMDB when missing or expired."""
+        key = (content_type, int(item_id))
+        results = self._fresh(key)
+        if results is None:
+            results = api.fetch_watch_providers(item_id, content_type)
+            if results is None:
+                return None
+            results = self.put(item_id, content_type, results)
+        return results
+
+    def get(self, item_id: int, content_type: str = "movie", region: str = "SA", kind: str = "flatrate") -> List[Dict]:
+        return ((self.results(item_id, content_type) or {}).get(region) or {}).get(kind, [])
+
+    def peek(self, item_id: int, content_type: str = "movie") -> Optional[Dict]:
+        """Stored results without fetching (None when unknown or expired)."""
+        return self._fresh((content_type, int(item_id)))
+
+    def items_for(self, provider_id: int, region: str) -> set:
+        now = time.time()
+        with self._lock:
+            keys = self._index.get(region, {}).get(int(provider_id), ())
+            return {k for k in keys if self._items[k][0] > now}
+
+    def available(self, provider_ids: Iterable[int], region: str) -> set:
+        """Items known to be on any of the given providers in a region."""
+        found = set()
+        for pid in provider_ids:
+            found |= self.items_for(pid, region)
+        return found
+
+    def filter_items(self, items: List[MediaRecord], provider_ids: Iterable[int],
+                     region: str) -> List[Tuple[MediaRecord, str]]:
+        """
+        Filter grid items by the given providers without TMDB calls (call
+        fill() first). Returns (item, "available" | "unknown") pairs: items
+        known to be on a provider are "available", items not fetched yet are
+        kept as "unknown", and items known to be elsewhere are dropped.
+        """
+        keys = self.available(provider_ids, region)
+        kept = []
+        for it in items:
+            key = (it.media_type, it.id)
+            if key in keys:
+                kept.append((it, "available"))
+            elif self._fresh(key) is None:
+                kept.append((it, "unknown"))
+        return kept
+
+    def providers_in(self, region: str) -> List[Dict]:
+        """Providers seen in a region, most titles first."""
+        with self._lock:
+            counts = [(pid, len(keys)) for pid, keys in self._index.get(region, {}).items() if keys]
+            names = dict(self._names)
+        counts.sort(key=lambda c: c[1], reverse=True)
+        return [{"id": pid, "name": names[pid][0], "logo_path": names[pid][1], "count": n} for pid, n in counts]
+
+    # -- writes ------------------------------------------------------------
+
+    def _pool(self):
+        # Created lazily, and again after a fork (gunicorn preload).
+        if self._executor is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._executor = ThreadPoolExecutor(max_workers=FILL_WORKERS, thread_name_prefix="providers")
+        return self._executor
+
+    def fill(self, items: List[MediaRecord]) -> int:
+        """
+        Fetch providers for grid items not in the store, in parallel, waiting
+        at most fill_budget seconds; slower fetches complete in the background.
+        Skipped while TMDB is rate limiting us. Returns the number started.
+        """
+        if api.tmdb_throttled():
+            return 0
+        keys = []
+        for it in items:
+            key = (it.media_type, int(it.id))
+            if key not in keys and self._fresh(key) is None:
+                keys.append(key)
+        with self._lock:
+            keys = [k for k in keys if k not in self._pending]
+            keys = keys[:max(0, self.fill_max_inflight - len(self._pending))]
+            self._pending.update(keys)
+            pool = self._pool() if keys else None
+        if not keys:
+            return 0
+        wait([pool.submit(self._fill_one, key) for key in keys], timeout=self.fill_budget)
+        return len(keys)
+
+    def _fill_one(self, key: ItemKey):
+        try:
+            if not api.tmdb_throttled():
+                self.results(key[1], key[0])
+        except Exception:
+            logger.exception("Provider fill error for %s", key)
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def put(self, item_id: int, content_type: str, results: Dict) -> Dict:
+        """Trim and store a watch/providers response; returns the trimmed results."""
+        key = (content_type, int(item_id))
+        ttl = self.ttl if results else self.empty_ttl
+        results = trim(results)
+        size = results_nbytes(results)
+        if size > self.max_bytes:
+            return results
+        with self._lock:
+            self._unindex(key)
+            if self.bytes + size > self.max_bytes:
+                self._evict(size)
+            self._items[key] = (time.time() + ttl, results, size)
+            self.bytes += size
+            for region, offers in results.items():
+                by_provider = self._index.setdefault(region, {})
+                for kind in INDEXED_KINDS:
+                    for p in offers.get(kind) or []:
+                        pid = p.get("provider_id")
+                        if pid is None:
+                            continue
+                        by_provider.setdefault(pid, set()).add(key)
+                        self._names[pid] = (p.get("provider_name"), p.get("logo_path"))
+        return results
+
+    def _unindex(self, key: ItemKey):
+        entry = self._items.pop(key, None)
+        if not entry:
+            return
+        self.bytes -= entry[2]
+        for region, offers in entry[1].items():
+            by_provider = self._index.get(region, {})
+            for kind in INDEXED_KINDS:
+                for p in offers.get(kind) or []:
+                    by_provider.get(p.get("provider_id"), set()).discard(key)
+
+    def _evict(self, incoming: int):
+        # Drop expired entries first, then the ones closest to expiry, leaving 10% headroom.
+        now = time.time()
+        for k in [k for k, entry in self._items.items() if entry[0] <= now]:
+            self._unindex(k)
+        for k in sorted(self._items, key=lambda k: self._items[k][0]):
+            if self.bytes + incoming <= self.max_bytes * 0.9:
+                break
+            self._unindex(k)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._index.clear()
+            self._names.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"items": len(self._items), "bytes": self.bytes, "max_bytes": self.max_bytes,
+                    "pending": len(self._pending)}
+
+
+# Process-wide store shared by the Flask routes and the Streamlit frontend.
+store = ProviderStore()
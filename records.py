@@ -0,0 +1,119 @@
+# records.py - compact media records and a byte-bounded cache for them
+import sys
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional
+
+
+class MediaRecord:
+    """
+    The fields we actually render for a movie/show, built once from a TMDB
+    result at the API boundary and shared by caches, routes and session state.
+    """
+
+    __slots__ = ("id", "media_type", "title", "poster_path", "backdrop_path", "overview", "year")
+
+    def __init__(self, id: int, media_type: str, title: str, poster_path: Optional[str] = None,
+                 backdrop_path: Optional[str] = None, overview: str = "", year: Optional[int] = None):
+        self.id = id
+        self.media_type = media_type
+        self.title = title
+        self.poster_path = poster_path
+        self.backdrop_path = backdrop_path
+        self.overview = overview
+        self.year = year
+
+    @classmethod
+    def from_tmdb(cls, item: Dict, content_type: Optional[str] = None) -> "MediaRecord":
+        media_type = content_type or item.get("media_type")
+        if media_type not in ("movie", "tv"):
+            media_type = "movie" if item.get("title") else "tv"
+        date = item.get("release_date") or item.get("first_air_date") or ""
+        return cls(
+            id=item.get("id"),
+            media_type=media_type,
+            title=item.get("title") or item.get("name") or "",
+            poster_path=item.get("poster_path"),
+            backdrop_path=item.get("backdrop_path"),
+            overview=item.get("overview") or "",
+            year=int(date[:4]) if date[:4].isdigit() else None,
+        )
+
+    def to_card(self, image_url: str) -> Dict:
+        """JSON projection used by the Flask routes and the web UI."""
+        return {
+            "title": self.title,
+            "poster": image_url + self.poster_path if self.poster_path else None,
+            "id": self.id,
+            "type": self.media_type,
+            "overview": self.overview,
+        }
+
+    def nbytes(self) -> int:
+        return sys.getsizeof(self) + sum(sys.getsizeof(getattr(self, f)) for f in self.__slots__)
+
+    def __getstate__(self):
+        return tuple(getattr(self, f) for f in self.__slots__)
+
+    def __setstate__(self, state):
+        for f, v in zip(self.__slots__, state):
+            setattr(self, f, v)
+
+    def __eq__(self, other):
+        return isinstance(other, MediaRecord) and self.__getstate__() == other.__getstate__()
+
+    def __hash__(self):
+        return hash((self.media_type, self.id))
+
+    def __repr__(self):
+        return f"MediaRecord({self.media_type}:{self.id} {self.title!r})"
+
+
+def records_nbytes(records: List[MediaRecord]) -> int:
+    return sys.getsizeof(records) + sum(r.nbytes() for r in records)
+
+
+class RecordCache:
+    """LRU cache of record lists whose limit is in bytes rather than entries."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (records, nbytes)
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[List[MediaRecord]]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, records: List[MediaRecord]):
+        size = records_nbytes(records)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._data[key] = (records, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self._data.popitem(last=False)
+                self.bytes -= evicted
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"entries": len(self._data), "bytes": self.bytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,93 @@
+# startup.py - cold start profiling
+"""
+Startup profile mode.
+
+    python startup.py [module] [--top N]
+
+Imports `module` (default: app) in a fresh interpreter with `-X importtime`
+and reports the cumulative import cost per module, then times the pre-fork
+preload_state() and the first response of a fresh Flask worker with and
+without preload, each in its own interpreter.
+"""
+import argparse
+import subprocess
+import sys
+import time
+
+
+def import_costs(module: str = "app"):
+    """Return [(module_name, self_us, cumulative_us)] for a fresh `import module`."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True,
+    )
+    costs = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        try:
+            self_us, cumulative_us = int(parts[0]), int(parts[1])
+        except ValueError:
+            continue  # header line
+        costs.append((parts[2].strip(), self_us, cumulative_us))
+    return costs
+
+
+def _timed(code: str) -> float:
+    """Run `code` in a fresh interpreter; it must print elapsed seconds last."""
+    proc = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "startup probe failed")
+    return float(proc.stdout.split()[-1])
+
+
+def preload_time() -> float:
+    """Seconds spent in app.preload_state(), as run by gunicorn before fork."""
+    return _timed(
+        "import time, app\n"
+        "start = time.perf_counter()\n"
+        "app.preload_state()\n"
+        "print(time.perf_counter() - start)"
+    )
+
+
+def first_response_time(path: str = "/", preload: bool = False) -> float:
+    """
+    Seconds to the first response of a fresh worker. Without preload this
+    includes `import app`; with preload the import and preload_state() have
+    already run in the master, so only the request itself is timed.
+    """
+    return _timed(
+        "import time\n"
+        "start = time.perf_counter()\n"
+        "import app\n"
+        f"if {preload!r}:\n"
+        "    app.preload_state()\n"
+        "    start = time.perf_counter()\n"
+        f"app.app.test_client().get({path!r})\n"
+        "print(time.perf_counter() - start)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report import-time cost per module.")
+    parser.add_argument("module", nargs="?", default="app")
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+
+    costs = import_costs(args.module)
+    total = max((c[2] for c in costs), default=0)
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for name, self_us, cum_us in sorted(costs, key=lambda c: c[2], reverse=True)[:args.top]:
+        print(f"{cum_us / 1000:14.1f} {self_us / 1000:9.1f}  {name}")
+    print(f"total import time: {total / 1000:.1f} ms")
+
+    if args.module == "app":
+        print(f"preload_state: {preload_time() * 1000:.1f} ms")
+        print(f"time to first response (cold worker): {first_response_time() * 1000:.1f} ms")
+        print(f"time to first response (after preload): {first_response_time(preload=True) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
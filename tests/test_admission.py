@@ -0,0 +1,68 @@
+import pytest
+
+import admission
+
+LIMITS = {
+    "cheap": {"rate": 100.0, "burst": 100, "slots": 4, "latency_target": 1.0, "service_time": 0.1},
+    "expensive": {"rate": 100.0, "burst": 100, "slots": 4, "latency_target": 30.0, "service_time": 5.0},
+    "stream": {"rate": 100.0, "burst": 100, "slots": 1, "latency_target": 0.0, "service_time": 60.0},
+}
+
+
+def controller(limits=LIMITS, threads=6, cheap_reserve=2):
+    return admission.AdmissionController(limits=limits, enabled=True, threads=threads, cheap_reserve=cheap_reserve)
+
+
+def test_rate_limit_is_per_client():
+    limits = dict(LIMITS, cheap=dict(LIMITS["cheap"], rate=0.01, burst=2))
+    c = controller(limits)
+    for _ in range(2):
+        c.release("cheap", c.acquire("cheap", "a"))
+    with pytest.raises(admission.AdmissionError) as e:
+        c.acquire("cheap", "a")
+    assert e.value.status == 429 and e.value.retry_after >= 1
+    assert c.acquire("cheap", "b") is not None
+
+
+def test_non_cheap_requests_leave_threads_for_cheap_routes():
+    c = controller(threads=6, cheap_reserve=2)
+    held = [c.acquire("expensive", str(i)) for i in range(4)]
+    with pytest.raises(admission.AdmissionError) as e:
+        c.acquire("expensive", "x")
+    assert e.value.status == 503
+    assert c.stats()["classes"]["expensive"]["shed_threads"] == 1
+    # Streams count against the same budget; cheap routes still get in.
+    with pytest.raises(admission.AdmissionError):
+        c.acquire("stream", "x")
+    assert c.acquire("cheap", "x") is not None
+    c.release("expensive", held[0])
+    assert c.acquire("expensive", "x") is not None
+
+
+def test_streams_are_never_queued():
+    c = controller()
+    c.acquire("stream", "a")
+    with pytest.raises(admission.AdmissionError) as e:
+        c.acquire("stream", "b")
+    assert e.value.status == 503
+    assert c.stats()["classes"]["stream"]["shed_queue"] == 1
+
+
+def test_unknown_class_and_disabled_are_not_limited():
+    c = controller()
+    assert c.acquire("other", "a") is None
+    off = admission.AdmissionController(limits=LIMITS, enabled=False)
+    assert off.acquire("expensive", "a") is None
+    off.release("expensive", None)
+
+
+def test_shed_responses_carry_a_message(monkeypatch):
+    app = pytest.importorskip("app")
+    limits = dict(LIMITS, cheap=dict(LIMITS["cheap"], rate=0.01, burst=1))
+    monkeypatch.setattr(admission, "controller", controller(limits))
+    client = app.app.test_client()
+    client.post("/search", data={"query": ""})
+    resp = client.post("/search", data={"query": ""})
+    assert resp.status_code == 429 and int(resp.headers["Retry-After"]) >= 1
+    body = resp.get_json()
+    assert body["movies"] == [] and "try again" in body["response"]
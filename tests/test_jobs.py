@@ -0,0 +1,89 @@
+import time
+
+import pytest
+
+import jobs
+
+
+@pytest.fixture
+def queue(tmp_path):
+    q = jobs.JobQueue(path=str(tmp_path / "jobs.sqlite3"), workers=1, result_ttl=60)
+    q.register("double", lambda p: {"x": p["x"] * 2})
+    return q
+
+
+def wait_for(queue, job_id, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = queue.get(job_id)
+        if job and job["status"] in (jobs.DONE, jobs.FAILED):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def test_runs_job_and_stores_result(queue):
+    job = wait_for(queue, queue.submit("double", {"x": 21}))
+    assert job["status"] == jobs.DONE
+    assert job["result"] == {"x": 42}
+
+
+def test_identical_submissions_share_a_job(queue):
+    first = queue.submit("double", {"x": 1})
+    assert queue.submit("double", {"x": 1}) == first
+    assert queue.submit("double", {"x": 2}) != first
+    wait_for(queue, first)
+    # A fresh result is reused too.
+    assert queue.submit("double", {"x": 1}) == first
+
+
+def test_failed_jobs_are_not_reused(queue):
+    def boom(payload):
+        raise RuntimeError("Error from AI provider: 503")
+
+    queue.register("boom", boom)
+    first = queue.submit("boom", {})
+    job = wait_for(queue, first)
+    assert job["status"] == jobs.FAILED
+    assert "503" in job["error"]
+    assert queue.submit("boom", {}) != first
+
+
+def test_expected_failures_log_without_traceback(queue, caplog):
+    def refuse(payload):
+        raise jobs.JobFailed("Error: OPENROUTER_API_KEY is missing.")
+
+    queue.register("refuse", refuse)
+    job = wait_for(queue, queue.submit("refuse", {}))
+    assert job["status"] == jobs.FAILED and "missing" in job["error"]
+    failures = [r for r in caplog.records if "(refuse) failed" in r.getMessage()]
+    assert failures and all(r.levelname == "WARNING" and not r.exc_info for r in failures)
+
+
+def test_worker_survives_finish_errors(queue, monkeypatch):
+    finish = queue._finish
+    broken = {"calls": 0}
+
+    def flaky_finish(job_id, result=None, error=None):
+        broken["calls"] += 1
+        if broken["calls"] <= 2:  # the result and then the failure can't be written
+            raise RuntimeError("database is locked")
+        finish(job_id, result, error)
+
+    monkeypatch.setattr(queue, "_finish", flaky_finish)
+    lost = queue.submit("double", {"x": 1})
+    assert wait_for(queue, queue.submit("double", {"x": 5}))["result"] == {"x": 10}
+    assert queue.get(lost)["status"] == jobs.RUNNING
+
+
+def test_claims_by_priority(tmp_path):
+    q = jobs.JobQueue(path=str(tmp_path / "jobs.sqlite3"), workers=0)  # claim by hand
+    low = q.submit("noop", {"n": 1}, priority=1)
+    high = q.submit("noop", {"n": 2}, priority=9)
+    assert q._claim()["id"] == high
+    assert q._claim()["id"] == low
+    assert q._claim() is None
+
+
+def test_unknown_job(queue):
+    assert queue.get("missing") is None
@@ -0,0 +1,77 @@
+import threading
+import time
+
+import pytest
+
+import api
+import prefetch
+import providers
+
+
+@pytest.fixture
+def fetched(monkeypatch):
+    calls = []
+    monkeypatch.setattr(api, "tmdb_throttled", lambda: False)
+    monkeypatch.setattr(api, "trailer_cached", lambda item_id, content_type: False)
+    monkeypatch.setattr(api, "get_trailer", lambda item_id, content_type: "key")
+    monkeypatch.setattr(providers, "store", providers.ProviderStore())
+
+    def results(item_id, content_type):
+        calls.append(item_id)
+        return None if item_id == "99" else {}
+
+    monkeypatch.setattr(providers.store, "results", results)
+    return calls
+
+
+def settle(p, timeout=5.0):
+    deadline = time.time() + timeout
+    while p.stats()["inflight"] and time.time() < deadline:
+        time.sleep(0.01)
+
+
+def cards(*ids):
+    return [{"id": i, "type": "movie"} for i in ids]
+
+
+def test_warms_top_k_and_counts_hits(fetched):
+    p = prefetch.Prefetcher(enabled=True, top_k=2)
+    p.schedule(cards(1, 2, 3))
+    settle(p)
+    assert sorted(fetched) == ["1", "2"]
+    p.record_open(1, "movie")
+    p.record_open(3, "movie")
+    s = p.stats()
+    assert (s["warmed"], s["hits"], s["pending"]) == (2, 1, 1)
+
+
+def test_failed_fetches_are_errors_not_waste(fetched):
+    p = prefetch.Prefetcher(enabled=True, top_k=4, hit_window=0)
+    p.schedule(cards(99, 1))
+    settle(p)
+    time.sleep(0.01)
+    s = p.stats()
+    assert (s["warmed"], s["errors"], s["wasted"]) == (1, 1, 1)
+    assert s["waste_ratio"] == 1.0
+
+
+def test_inflight_cap_and_budget(fetched, monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(providers.store, "results", lambda item_id, content_type: release.wait(5) and {})
+    p = prefetch.Prefetcher(enabled=True, top_k=4, max_inflight=3)
+    p.schedule(cards(1, 2, 3, 4))
+    assert p.stats()["cancelled"] == 1
+    release.set()
+    settle(p)
+    # Past the budget nothing is fetched.
+    p.budget = -1
+    p.schedule(cards(5))
+    settle(p)
+    s = p.stats()
+    assert (s["scheduled"], s["warmed"], s["cancelled"]) == (5, 3, 2)
+
+
+def test_disabled_does_nothing(fetched):
+    p = prefetch.Prefetcher(enabled=False)
+    p.schedule(cards(1))
+    assert p.stats()["scheduled"] == 0 and fetched == []
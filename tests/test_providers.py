@@ -0,0 +1,83 @@
+import pytest
+
+import api
+import providers
+from records import MediaRecord
+
+
+def offers(*pids, kind="flatrate"):
+    return {kind: [{"provider_id": p, "provider_name": f"P{p}", "logo_path": f"/{p}.png", "display_priority": 1}
+                   for p in pids],
+            "link": "https://www.themoviedb.org/movie/1/watch", "buy": [{"provider_id": 99}]}
+
+
+def record(item_id):
+    return MediaRecord(item_id, "movie", f"Movie {item_id}", poster_path="/p.jpg")
+
+
+@pytest.fixture
+def store(monkeypatch):
+    monkeypatch.setattr(api, "tmdb_throttled", lambda: False)
+    return providers.ProviderStore(ttl=60, empty_ttl=60, max_bytes=1024 * 1024, fill_budget=5.0)
+
+
+def test_trim_keeps_indexed_offers_only():
+    trimmed = providers.trim({"SA": offers(8), "US": {"rent": [{"provider_id": 2}]}})
+    assert trimmed == {"SA": {"flatrate": [{"provider_id": 8, "provider_name": "P8", "logo_path": "/8.png"}]}}
+
+
+def test_put_replaces_index_entries(store):
+    store.put(1, "movie", {"SA": offers(8)})
+    store.put(1, "movie", {"SA": offers(9), "US": offers(8)})
+    assert store.items_for(8, "SA") == set()
+    assert store.items_for(9, "SA") == {("movie", 1)}
+    assert store.items_for(8, "US") == {("movie", 1)}
+    assert [p["id"] for p in store.providers_in("SA")] == [9]
+
+
+def test_expired_items_are_unknown(store):
+    store.ttl = -1
+    store.put(1, "movie", {"SA": offers(8)})
+    assert store.peek(1) is None
+    assert store.items_for(8, "SA") == set()
+    assert store.filter_items([record(1)], [8], "SA") == [(record(1), "unknown")]
+
+
+def test_filter_drops_items_known_elsewhere(store):
+    store.put(1, "movie", {"SA": offers(8)})
+    store.put(2, "movie", {"SA": offers(9)})
+    kept = store.filter_items([record(1), record(2), record(3)], [8], "SA")
+    assert kept == [(record(1), "available"), (record(3), "unknown")]
+
+
+def test_evicts_by_bytes_and_unindexes(store):
+    size = providers.results_nbytes(providers.trim({"SA": offers(8)}))
+    store.max_bytes = size * 3
+    for i in range(5):
+        store.put(i, "movie", {"SA": offers(8)})
+    assert store.bytes <= store.max_bytes
+    assert store.bytes == sum(e[2] for e in store._items.values())
+    assert store.items_for(8, "SA") == set(store._items)
+    assert ("movie", 4) in store._items
+    store.clear()
+    assert store.bytes == 0 and store.providers_in("SA") == []
+
+
+def test_fill_fetches_missing_items_once(store, monkeypatch):
+    calls = []
+
+    def fetch(item_id, content_type):
+        calls.append(item_id)
+        return {"SA": offers(8)} if item_id == 2 else None  # 3 fails
+
+    monkeypatch.setattr(api, "fetch_watch_providers", fetch)
+    store.put(1, "movie", {"SA": offers(9)})
+    assert store.fill([record(1), record(2), record(3), record(2)]) == 2
+    assert sorted(calls) == [2, 3]
+    kept = store.filter_items([record(1), record(2), record(3)], [8], "SA")
+    assert kept == [(record(2), "available"), (record(3), "unknown")]
+
+
+def test_fill_skipped_while_throttled(store, monkeypatch):
+    monkeypatch.setattr(api, "tmdb_throttled", lambda: True)
+    assert store.fill([record(1)]) == 0
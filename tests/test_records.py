@@ -0,0 +1,47 @@
+import pickle
+
+from records import MediaRecord, RecordCache, records_nbytes
+
+
+def records(n, start=0):
+    return [MediaRecord(i, "movie", f"Movie {i}", poster_path=f"/{i}.jpg", overview="x" * 50)
+            for i in range(start, start + n)]
+
+
+def test_from_tmdb_and_card():
+    r = MediaRecord.from_tmdb({"id": 7, "name": "Dark", "first_air_date": "2017-12-01", "poster_path": "/d.jpg"})
+    assert (r.media_type, r.title, r.year) == ("tv", "Dark", 2017)
+    assert r.to_card("https://img")["poster"] == "https://img/d.jpg"
+    assert pickle.loads(pickle.dumps(r)) == r
+
+
+def test_byte_accounting():
+    cache = RecordCache(max_bytes=10 ** 6)
+    a, b = records(3), records(5)
+    cache.put("a", a)
+    cache.put("b", b)
+    assert cache.bytes == records_nbytes(a) + records_nbytes(b)
+    cache.put("a", b)  # replacing an entry releases its old size
+    assert cache.bytes == 2 * records_nbytes(b)
+    cache.clear()
+    assert cache.bytes == 0 and cache.get("a") is None
+
+
+def test_evicts_least_recently_used_by_bytes():
+    size = records_nbytes(records(4))
+    cache = RecordCache(max_bytes=size * 5 // 2)
+    cache.put("a", records(4))
+    cache.put("b", records(4, 10))
+    assert cache.get("a") is not None  # "b" is now the oldest
+    cache.put("c", records(4, 20))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.bytes <= cache.max_bytes
+    s = cache.stats()
+    assert (s["entries"], s["hits"], s["misses"]) == (2, 3, 1)
+
+
+def test_oversized_entries_are_not_stored():
+    cache = RecordCache(max_bytes=100)
+    cache.put("big", records(10))
+    assert cache.get("big") is None and cache.bytes == 0
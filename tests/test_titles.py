@@ -0,0 +1,82 @@
+import titles
+from titles import TitleParser, TitleRef
+
+
+def test_normalizes_and_dedupes_variants():
+    refs = titles.parse_titles("Try [Inception], [ Inception (2010) ] or [inception].")
+    assert refs == [TitleRef("Inception", 2010, None)]
+
+
+def test_hint_groups():
+    assert titles.parse_title("Dark (2017, TV)") == TitleRef("Dark", 2017, "tv")
+    assert titles.parse_title("**Up** (film)") == TitleRef("Up", None, "movie")
+    # A parenthetical that isn't a hint stays part of the title.
+    birdman = "Birdman (or The Unexpected Virtue of Ignorance)"
+    assert titles.parse_title(birdman) == TitleRef(birdman)
+
+
+def test_skips_non_titles():
+    text = "See [docs](https://example.com), [...], [ ], [Brackets] and [Heat]."
+    assert titles.parse_titles(text) == [TitleRef("Heat")]
+
+
+def test_numeric_titles_are_kept():
+    refs = titles.parse_titles("Watch [1917], [300], [21] or [9].")
+    assert [r.title for r in refs] == ["1917", "300", "21", "9"]
+
+
+def test_footnote_markers_are_skipped():
+    text = "A great war film[1] is [1917].\n[2]: https://example.com"
+    assert titles.parse_titles(text) == [TitleRef("1917")]
+
+
+def test_feed_across_chunk_boundaries():
+    parser = TitleParser()
+    found = []
+    for chunk in ["Watch [Incep", "tion (2010)]", " then [Her]", "(https://x) and [Dune]"]:
+        found += parser.feed(chunk)
+    found += parser.close()
+    assert found == [TitleRef("Inception", 2010), TitleRef("Dune")]
+
+
+def test_feed_holds_title_until_next_char():
+    parser = TitleParser()
+    assert parser.feed("Try [Heat]") == []  # could still be "[Heat](url)"
+    assert parser.feed(" now") == [TitleRef("Heat")]
+
+
+def test_feed_footnote_split_from_its_word():
+    parser = TitleParser()
+    assert parser.feed("a classic") == []
+    assert parser.feed("[1] and [21] ") == [TitleRef("21")]
+
+
+def test_feed_dedupes_across_chunks():
+    parser = TitleParser()
+    assert parser.feed("[Heat] ") == [TitleRef("Heat")]
+    assert parser.feed("[heat] [HEAT (1995)] ") == []
+
+
+def test_structured_reply():
+    text = ('```json\n{"commentary": "Mind-benders", "titles": [{"title": "Inception", "year": 2010, '
+            '"type": "movie"}, {"title": "Dark", "year": "2017", "type": "tv"}, {"title": 5}]}\n```')
+    commentary, refs = titles.parse_reply(text)
+    assert commentary == "Mind-benders"
+    assert refs == [TitleRef("Inception", 2010, "movie"), TitleRef("Dark", 2017, "tv")]
+    assert titles.format_refs(refs) == "[Inception (2010)] [Dark (2017, TV)]"
+
+
+def test_reply_falls_back_to_brackets():
+    assert titles.parse_reply("Try [Heat (1995)]") == ("Try [Heat (1995)]", [TitleRef("Heat", 1995)])
+
+
+def test_off_schema_json_is_not_shown_raw():
+    assert titles.parse_reply('{"answer": "Try [Heat]"}') == ("Try [Heat]", [TitleRef("Heat")])
+    assert titles.parse_reply('{"titles": "Heat"}') == (titles.UNREADABLE_REPLY, [])
+    # A bare JSON scalar is just text.
+    assert titles.parse_reply("1917") == ("1917", [])
+
+
+def test_placeholders_need_no_year():
+    assert titles.parse_titles("Try [X (2022)] or [Pearl (2022)]") == [TitleRef("X", 2022), TitleRef("Pearl", 2022)]
+    assert titles.parse_titles("[Movie Title] and [X]") == [TitleRef("X")]
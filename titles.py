@@ -0,0 +1,227 @@
+# titles.py - shared parser for the [Bracketed] titles in AI responses
+import json
+import re
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+MAX_TITLE_LEN = 80
+
+# A bracket pair on a single line with no nested brackets.
+BRACKET_RE = re.compile(r"\[([^\[\]\n]*)\]")
+# Trailing "(...)" group holding hints, e.g. "Dark (2017, TV)".
+HINT_GROUP_RE = re.compile(r"\s*\(([^()]*)\)\s*$")
+YEAR_RE = re.compile(r"^(?:18|19|20)\d{2}$")
+# Footnote / reference markers are short numbers glued to the previous word: "text[1]".
+FOOTNOTE_MAX_DIGITS = 3
+JSON_FENCE_RE = re.compile(r"^\s*```(?:json)?\s*(.*?)\s*```\s*$", re.DOTALL)
+
+TYPE_HINTS = {
+    "movie": "movie", "film": "movie",
+    "tv": "tv", "series": "tv", "tv series": "tv", "tv show": "tv", "show": "tv",
+    "mini-series": "tv", "miniseries": "tv", "anime": "tv",
+}
+# Words the model sometimes echoes back from the prompt instead of a real title;
+# only checked when the bracket has no year, so "[X (2022)]" is kept.
+PLACEHOLDERS = {"brackets", "title", "movie title", "movie", "film", "tv", "..."}
+STRIP_CHARS = " \t\"'*_`“”«»"
+# Shown when a reply is JSON but neither matches the schema nor has a text field.
+UNREADABLE_REPLY = "Sorry, the AI reply could not be read. Please try again."
+TEXT_FIELDS = ("commentary", "text", "response", "answer", "message", "content")
+
+
+class TitleRef(NamedTuple):
+    title: str
+    year: Optional[int] = None
+    media_type: Optional[str] = None  # "movie" / "tv" / None (unknown)
+
+    @property
+    def key(self) -> str:
+        return self.title.casefold()
+
+
+def _parse_hints(group: str):
+    """Return (year, media_type) from a hint group, or None if it holds anything else."""
+    year, media_type = None, None
+    for token in re.split(r"[,;/]", group):
+        token = token.strip().lower()
+        if not token:
+            continue
+        if YEAR_RE.match(token):
+            year = int(token)
+        elif token in TYPE_HINTS:
+            media_type = TYPE_HINTS[token]
+        else:
+            return None
+    return year, media_type
+
+
+def parse_title(raw: str) -> Optional[TitleRef]:
+    """Normalize one bracket body into a TitleRef, or None if it isn't a title."""
+    title = " ".join((raw or "").split()).strip(STRIP_CHARS)
+    year, media_type = None, None
+    while True:
+        m = HINT_GROUP_RE.search(title)
+        if not m:
+            break
+        hints = _parse_hints(m.group(1))
+        if hints is None:
+            break  # part of the title, e.g. "Birdman (or The Unexpected Virtue...)"
+        year = year or hints[0]
+        media_type = media_type or hints[1]
+        title = title[:m.start()].strip(STRIP_CHARS)
+
+    if not title or len(title) > MAX_TITLE_LEN:
+        return None
+    if not any(ch.isalnum() for ch in title):
+        return None  # "[...]", "[ ]", "[-]"
+    if year is None and title.lower() in PLACEHOLDERS:
+        return None
+    return TitleRef(title, year, media_type)
+
+
+class TitleParser:
+    """
+    Incremental parser: feed() it streamed chunks and it returns the new,
+    deduplicated titles completed by each chunk. Call close() at the end.
+    """
+
+    def __init__(self, dedupe: bool = True):
+        self._buf = ""
+        self._prev = ""  # last character consumed before the buffer
+        self._seen = set()
+        self._dedupe = dedupe
+
+    def feed(self, chunk: str) -> List[TitleRef]:
+        self._buf += chunk or ""
+        return self._drain(final=False)
+
+    def close(self) -> List[TitleRef]:
+        refs = self._drain(final=True)
+        self._buf = ""
+        return refs
+
+    def _drain(self, final: bool) -> List[TitleRef]:
+        text = self._buf
+        found = []
+        pos = 0
+        for m in BRACKET_RE.finditer(text):
+            if m.end() == len(text) and not final:
+                break  # need the next character to rule out a markdown link
+            pos = m.end()
+            if text.startswith("(", m.end()):
+                continue  # [label](url)
+            before = text[m.start() - 1] if m.start() > 0 else self._prev
+            if self._is_footnote(m.group(1), before, text[m.end():m.end() + 1]):
+                continue
+            ref = parse_title(m.group(1))
+            if ref is None or (self._dedupe and ref.key in self._seen):
+                continue
+            self._seen.add(ref.key)
+            found.append(ref)
+
+        # Keep only an unterminated "[..." tail that could still become a title.
+        start = text.find("[", pos)
+        tail = text[start:] if start >= 0 else ""
+        if "\n" in tail or len(tail) > MAX_TITLE_LEN + 2:
+            tail = ""
+        consumed = text[:len(text) - len(tail)]
+        if consumed:
+            self._prev = consumed[-1]
+        self._buf = tail
+        return found
+
+    @staticmethod
+    def _is_footnote(body: str, before: str, after: str) -> bool:
+        """
+        "[1]" glued to a word ("text[1]") or a reference definition ("[1]: url").
+        Standalone numbers like "[1917]" or "watch [21]" are real titles.
+        """
+        body = body.strip()
+        if not body.isdigit() or len(body) > FOOTNOTE_MAX_DIGITS:
+            return False
+        return after == ":" or bool(before) and not before.isspace() and before not in "([{*_\"'“«"
+
+
+def parse_titles(text: str) -> List[TitleRef]:
+    """
+    Parse a complete response. Duplicates are merged so that
+    "[Inception]" ... "[Inception (2010)]" yields one ref with the year.
+    """
+    parser = TitleParser(dedupe=False)
+    merged: Dict[str, TitleRef] = {}
+    for ref in parser.feed(text) + parser.close():
+        prev = merged.get(ref.key)
+        if prev is None:
+            merged[ref.key] = ref
+        else:
+            merged[ref.key] = prev._replace(year=prev.year or ref.year,
+                                            media_type=prev.media_type or ref.media_type)
+    return list(merged.values())
+
+
+def _load_json(text: str):
+    """The JSON object/array in a reply (optionally ```fenced```), else None."""
+    m = JSON_FENCE_RE.match(text or "")
+    try:
+        data = json.loads(m.group(1) if m else text or "")
+    except ValueError:
+        return None
+    return data if isinstance(data, (dict, list)) else None
+
+
+def format_refs(refs: List[TitleRef]) -> str:
+    """Refs back in bracket form, e.g. "[Inception (2010)] [Dark (2017, TV)]"."""
+    parts = []
+    for ref in refs:
+        hints = [str(ref.year)] if ref.year else []
+        if ref.media_type == "tv":
+            hints.append("TV")
+        parts.append(f"[{ref.title} ({', '.join(hints)})]" if hints else f"[{ref.title}]")
+    return " ".join(parts)
+
+
+def parse_structured(text: str) -> Optional[Tuple[str, List[TitleRef]]]:
+    """
+    Validate a structured reply:
+        {"commentary": str, "titles": [{"title": str, "year": int, "type": "movie"|"tv"}]}
+    Returns (commentary, refs), or None if the reply doesn't match the schema.
+    Individual entries that fail validation are dropped.
+    """
+    data = _load_json(text)
+    if not isinstance(data, dict) or not isinstance(data.get("titles"), list):
+        return None
+    commentary = data.get("commentary") or ""
+    if not isinstance(commentary, str):
+        return None
+
+    refs: Dict[str, TitleRef] = {}
+    for entry in data["titles"]:
+        if not isinstance(entry, dict) or not isinstance(entry.get("title"), str):
+            continue
+        ref = parse_title(entry["title"])
+        if ref is None:
+            continue
+        year = entry.get("year")
+        if isinstance(year, str) and YEAR_RE.match(year.strip()):
+            year = int(year)
+        if isinstance(year, int) and YEAR_RE.match(str(year)):
+            ref = ref._replace(year=year)
+        media_type = TYPE_HINTS.get(str(entry.get("type") or "").strip().lower())
+        if media_type:
+            ref = ref._replace(media_type=media_type)
+        refs.setdefault(ref.key, ref)
+    return commentary, list(refs.values())
+
+
+def parse_reply(text: str) -> Tuple[str, List[TitleRef]]:
+    """(commentary, refs) from a structured reply, falling back to [Bracket] parsing."""
+    structured = parse_structured(text)
+    if structured is not None:
+        return structured
+    data = _load_json(text)
+    if data is not None:
+        # JSON that doesn't match the schema: use a text field rather than show raw JSON.
+        fields = data if isinstance(data, dict) else {}
+        fallback = next((fields[f] for f in TEXT_FIELDS if isinstance(fields.get(f), str) and fields[f]),
+                         UNREADABLE_REPLY)
+        return fallback, parse_titles(fallback)
+    return text or "", parse_titles(text)